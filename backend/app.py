@@ -6,7 +6,7 @@
 # - If uploads work locally but not on Render, the proxy may be stripping or truncating uploads.
 # - For debugging, log raw request data length if file upload fails (see below).
 #
-from flask import Flask, request, jsonify, make_response
+from flask import Flask, Request, request, jsonify, make_response, stream_with_context
 from flask_cors import CORS, cross_origin
 import cv2
 import numpy as np
@@ -16,36 +16,84 @@ from mediapipe.tasks.python import vision
 from mediapipe.tasks.python.components import processors
 from mediapipe.framework.formats import landmark_pb2
 import base64
-import io
-from PIL import Image
 import time
 import os
 import math
+import operator
 import requests
 import gc
+import atexit
 import psutil
 from werkzeug.utils import secure_filename
 import multiprocessing
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+import queue
 import traceback
 import uuid
 import tempfile
+import shutil
 import logging
-from movenet_validator import infer_pose_bgr, _ort_sess
+from movenet_validator import infer_pose_bgr, load_session as load_movenet_session
+from pose_worker import ImageLandmarker, PoseWorker, VideoLandmarkerPool, create_pose_landmarker
+import squat_kernels
 import subprocess
 import json
+import hashlib
+import threading
+from collections import OrderedDict, deque, namedtuple
+import functools
+import contextlib
+import ctypes
+from pathlib import Path
+try:
+    import xxhash
+except ImportError:  # optional; frame_digest falls back to hashlib
+    xxhash = None
+try:
+    import orjson
+except ImportError:  # optional; dump_json falls back to the json module
+    orjson = None
+try:
+    import av
+except ImportError:  # optional; FrameStream falls back to cv2.VideoCapture
+    av = None
+
+class DiskUploadRequest(Request):
+    """Spool multipart file parts straight into named temp files.
+
+    Werkzeug keeps small parts in memory and writes large ones to anonymous temp
+    files that then have to be copied out with file.save(); a named file can be
+    renamed into place instead. Files nobody took over are removed when the
+    request closes.
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        suffix = os.path.splitext(filename or '')[1].lower()
+        stream = tempfile.NamedTemporaryFile(prefix='upload_', suffix=suffix, delete=False)
+        self.__dict__.setdefault('_spooled_paths', []).append(stream.name)
+        return stream
+
+    def close(self):
+        super().close()
+        for path in self.__dict__.get('_spooled_paths', ()):
+            Path(path).unlink(missing_ok=True)
 
 app = Flask(__name__)
+app.request_class = DiskUploadRequest
 import logging
 # Only show warnings and above in Flask logs
 app.logger.setLevel(logging.WARNING)
 # Suppress Werkzeug request logs
 logging.getLogger('werkzeug').setLevel(logging.ERROR)
+# SQUAT_MEM_DIAG=1 turns on the [MEM_DIAG]/[MEMORY] RSS logging; otherwise the RSS
+# reads (a /proc read each) are skipped altogether rather than logged and filtered out
+MEM_DIAG = os.environ.get('SQUAT_MEM_DIAG', '0') == '1'
 class MemoryFilter(logging.Filter):
     def filter(self, record):
         # Suppress logs containing memory diagnostics tag
         return "[MEM_DIAG]" not in record.getMessage()
-app.logger.addFilter(MemoryFilter())
+if not MEM_DIAG:
+    app.logger.addFilter(MemoryFilter())
 CORS(app, resources={
     r"/*": {
         "origins": ["https://squat-analyzer-frontend.onrender.com", "http://localhost:5173"],
@@ -98,14 +146,42 @@ class POSE_LANDMARKS:
     LEFT_FOOT_INDEX = 31
     RIGHT_FOOT_INDEX = 32
 
+# Left/right landmark pairs as index arrays, built once for the per-frame code paths
+KNEES = np.array([POSE_LANDMARKS.LEFT_KNEE, POSE_LANDMARKS.RIGHT_KNEE])
+# Rows: shoulders, hips, knees - one fancy index yields all three midpoints
+TORSO_PAIRS = np.array([
+    [POSE_LANDMARKS.LEFT_SHOULDER, POSE_LANDMARKS.RIGHT_SHOULDER],
+    [POSE_LANDMARKS.LEFT_HIP, POSE_LANDMARKS.RIGHT_HIP],
+    KNEES
+])
+# Live feedback needs every TORSO_PAIRS landmark at least this visible
+FEEDBACK_MIN_VISIBILITY = float(os.environ.get('FEEDBACK_MIN_VISIBILITY', '0.5'))
+
 # Function to download and cache the model
 def download_model(url, model_path):
+    """Download the model once; later boots only see that the file exists.
+
+    The download streams into a per-process partial file that is renamed into place
+    once it is complete, so an interrupted download (or a worker booting at the same
+    time) can never leave a truncated model behind that would pass the exists check.
+    """
     if not os.path.exists(model_path):
         print(f"Downloading model from {url} to {model_path}")
         os.makedirs(os.path.dirname(model_path), exist_ok=True)
-        response = requests.get(url)
-        with open(model_path, 'wb') as f:
-            f.write(response.content)
+        part_path = f"{model_path}.{os.getpid()}.part"
+        try:
+            with requests.get(url, stream=True, timeout=60) as response:
+                response.raise_for_status()
+                with open(part_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=1 << 20):
+                        f.write(chunk)
+                # Content-Length counts the encoded bytes, so it's only comparable without one
+                expected = None if 'Content-Encoding' in response.headers else response.headers.get('Content-Length')
+            if expected is not None and os.path.getsize(part_path) != int(expected):
+                raise IOError(f"incomplete model download ({os.path.getsize(part_path)} of {expected} bytes)")
+            os.replace(part_path, model_path)
+        finally:
+            Path(part_path).unlink(missing_ok=True)
     return model_path
 
 # Set up model paths (variant configurable to save memory on low-resource hosts like Render)
@@ -117,23 +193,86 @@ MODEL_PATH = os.path.join(os.path.dirname(__file__), 'models', f'pose_landmarker
 # Download and get the model path
 model_path = download_model(MODEL_URL, MODEL_PATH)
 
-# Initialize a global pose landmarker to reuse across requests and frames (helps memory)
-pose_landmarker_global = PoseLandmarker.create_from_options(
-    PoseLandmarkerOptions(
-        base_options=BaseOptions(model_asset_path=model_path),
-        running_mode=VisionRunningMode.IMAGE,
-        min_pose_detection_confidence=0.5,
-        min_pose_presence_confidence=0.5,
-        min_tracking_confidence=0.5
-    )
-)
+# A global pose landmarker reused across requests and frames (helps memory). MediaPipe's
+# graph threads don't survive a fork, so when gunicorn preloads the app (see
+# gunicorn_conf.py) the arbiter sets DEFER_MODEL_LOAD=1 and each worker calls
+# load_models() itself once it has forked
+pose_landmarker_global = None
+
+# The MoveNet cross-check runs on every MOVENET_STRIDE-th live frame of a session;
+# ENABLE_MOVENET_VALIDATOR=0 skips it altogether
+MOVENET_VALIDATOR = os.environ.get('ENABLE_MOVENET_VALIDATOR', '1') == '1'
+MOVENET_STRIDE = max(1, int(os.environ.get('MOVENET_STRIDE', '10')))
+
+def load_models():
+    """Create this process's inference models (the global landmarker and, unless the
+    validator is disabled, the MoveNet session) and compile, or load from the numba
+    cache, the squat kernels.
 
-# Global variables for squat state tracking
-previous_states = {}
-squat_timings = {}
-squat_counts = {}
-# Global dictionary to store session start times
-session_start_times = {}
+    The kernels are warmed here rather than at import: numba's threading layer
+    doesn't survive a fork either, so a preloading arbiter mustn't run them.
+    """
+    global pose_landmarker_global
+    if pose_landmarker_global is None:
+        pose_landmarker_global = create_pose_landmarker(model_path)
+    if MOVENET_VALIDATOR:
+        load_movenet_session()
+    squat_kernels.warm_up()
+
+if os.environ.get('DEFER_MODEL_LOAD') != '1':
+    load_models()
+
+# Optionally run live-frame inference in a separate process so MediaPipe's Python glue
+# doesn't contend for the GIL with request handling (costs one extra model in memory)
+POSE_WORKER_PROCESS = os.environ.get('POSE_WORKER_PROCESS', '0') == '1'
+pose_worker = PoseWorker(model_path) if POSE_WORKER_PROCESS else None
+
+# POSE_VIDEO_MODE=1 infers uploaded videos in VIDEO running mode so MediaPipe can track
+# the pose between frames; each concurrent video checks out its own landmarker from a
+# pool of at most POSE_VIDEO_LANDMARKERS (each one a full model in memory, on top of the
+# global one). Off by default: videos run through the IMAGE-mode global landmarker.
+POSE_VIDEO_MODE = os.environ.get('POSE_VIDEO_MODE', '0') == '1'
+POSE_VIDEO_LANDMARKERS = max(1, int(os.environ.get('POSE_VIDEO_LANDMARKERS', '2')))
+video_landmarkers = VideoLandmarkerPool(model_path, POSE_VIDEO_LANDMARKERS) if POSE_VIDEO_MODE else None
+if video_landmarkers is not None:
+    atexit.register(video_landmarkers.close)
+
+class SessionState:
+    """Squat tracking state for one live-analysis session."""
+    __slots__ = ('state', 'count', 'timings', 'start', 'frame_counter', 'last_diff_px')
+
+    def __init__(self):
+        self.state = "standing"
+        self.count = 0
+        self.timings = []
+        self.start = time.time()  # session start, for aligning squat timings
+        self.frame_counter = 0
+        self.last_diff_px = None  # last MoveNet/MediaPipe divergence
+
+# Live sessions, least recently used first; the oldest are evicted past MAX_SESSIONS
+MAX_SESSIONS = int(os.environ.get('MAX_SESSIONS', '1024'))
+sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+
+def get_session(session_id, create=True):
+    """Return the SessionState for session_id, starting a new one if needed (and create is set)."""
+    with _sessions_lock:
+        session = sessions.get(session_id)
+        if session is not None:
+            sessions.move_to_end(session_id)
+        elif create:
+            session = sessions[session_id] = SessionState()
+            if len(sessions) > MAX_SESSIONS:
+                sessions.popitem(last=False)
+        return session
+
+# Visibility threshold too high can filter out usable landmarks. We now:
+# 1. Keep a low visibility threshold (0.15).
+# 2. Additionally allow any landmark we actually track (see RELEVANT_MASK; the
+#    facial placeholders are never usable).  This dramatically increases the
+#    likelihood of computing angles when MediaPipe marks visibility low but the
+#    landmark position is still reasonably accurate.
+VIS_THR = 0.15
 
 # Allowed video file extensions
 ALLOWED_EXTENSIONS = {'mp4', 'webm', 'avi', 'mkv'}
@@ -142,42 +281,12 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def calculate_angle(a, b, c):
-    """Calculate the angle between three points with stability checks."""
+    """Calculate the angle (degrees) at b between three (x, y) points, with stability checks."""
     try:
-        # Get coordinates with fallbacks for all possible data formats
-        try:
-            # Try dictionary access first with proper conditional expressions
-            a_x = a.get('x', 0) if isinstance(a, dict) else (a.x if hasattr(a, 'x') else 0)
-            a_y = a.get('y', 0) if isinstance(a, dict) else (a.y if hasattr(a, 'y') else 0)
-            
-            b_x = b.get('x', 0) if isinstance(b, dict) else (b.x if hasattr(b, 'x') else 0)
-            b_y = b.get('y', 0) if isinstance(b, dict) else (b.y if hasattr(b, 'y') else 0)
-            
-            c_x = c.get('x', 0) if isinstance(c, dict) else (c.x if hasattr(c, 'x') else 0)
-            c_y = c.get('y', 0) if isinstance(c, dict) else (c.y if hasattr(c, 'y') else 0)
-        except Exception:
-            # More explicit approach if the above fails
-            if isinstance(a, dict):
-                a_x, a_y = a.get('x', 0), a.get('y', 0)
-            elif hasattr(a, 'x') and hasattr(a, 'y'):
-                a_x, a_y = a.x, a.y
-            else:
-                a_x, a_y = 0, 0
-                
-            if isinstance(b, dict):
-                b_x, b_y = b.get('x', 0), b.get('y', 0)
-            elif hasattr(b, 'x') and hasattr(b, 'y'):
-                b_x, b_y = b.x, b.y
-            else:
-                b_x, b_y = 0, 0
-                
-            if isinstance(c, dict):
-                c_x, c_y = c.get('x', 0), c.get('y', 0)
-            elif hasattr(c, 'x') and hasattr(c, 'y'):
-                c_x, c_y = c.x, c.y
-            else:
-                c_x, c_y = 0, 0
-            
+        a_x, a_y = a
+        b_x, b_y = b
+        c_x, c_y = c
+
         # Calculate vectors
         ba_x, ba_y = a_x - b_x, a_y - b_y
         bc_x, bc_y = c_x - b_x, c_y - b_y
@@ -186,8 +295,8 @@ def calculate_angle(a, b, c):
         dot_product = (ba_x * bc_x + ba_y * bc_y)
         
         # Calculate magnitudes
-        magnitude_ba = math.sqrt(ba_x**2 + ba_y**2)
-        magnitude_bc = math.sqrt(bc_x**2 + bc_y**2)
+        magnitude_ba = math.hypot(ba_x, ba_y)
+        magnitude_bc = math.hypot(bc_x, bc_y)
         
         # Handle division by zero
         if magnitude_ba < 1e-6 or magnitude_bc < 1e-6:
@@ -197,7 +306,7 @@ def calculate_angle(a, b, c):
         cosine_angle = dot_product / (magnitude_ba * magnitude_bc)
         
         # Clamp to valid range to handle floating point errors
-        cosine_angle = max(-1, min(1, cosine_angle))
+        cosine_angle = -1.0 if cosine_angle < -1.0 else (1.0 if cosine_angle > 1.0 else cosine_angle)
         
         # Calculate angle in degrees
         angle_rad = math.acos(cosine_angle)
@@ -208,114 +317,51 @@ def calculate_angle(a, b, c):
         app.logger.error(f"Error calculating angle: {str(e)}")
         return 0  # Default fallback value
 
-def calculate_depth_ratio(hip, knee, ankle):
-    """Calculate the depth ratio based on hip, knee, and ankle positions."""
-    try:
-        # Get coordinates safely, handling all possible data formats
-        hip_y = 0
-        knee_y = 0
-        ankle_y = 0
-        
-        # Get hip y-coordinate
-        if isinstance(hip, dict):
-            hip_y = hip.get('y', 0)
-        elif hasattr(hip, 'y'):
-            hip_y = hip.y
-        
-        # Get knee y-coordinate
-        if isinstance(knee, dict):
-            knee_y = knee.get('y', 0)
-        elif hasattr(knee, 'y'):
-            knee_y = knee.y
-            
-        # Get ankle y-coordinate
-        if isinstance(ankle, dict):
-            ankle_y = ankle.get('y', 0)
-        elif hasattr(ankle, 'y'):
-            ankle_y = ankle.y
-            
-        # Calculate distances
-        hip_to_knee = abs(hip_y - knee_y)
-        knee_to_ankle = abs(knee_y - ankle_y)
-        hip_to_ankle = abs(hip_y - ankle_y)
-        
-        if hip_to_ankle < 1e-6:
-            return 0
-            
-        # Calculate ratio
-        depth_ratio = knee_y / hip_to_ankle
-        
-        return depth_ratio * 100  # Scale for readability
-    except Exception as e:
-        app.logger.error(f"Error calculating depth ratio: {str(e)}")
-        return 0  # Default fallback value
+# --- Utility Functions (Refactored) ---
+_landmark_confidence = None
 
-def calculate_shoulder_midfoot_diff(shoulder, hip, knee, ankle):
-    """Calculate the horizontal difference between shoulder and midfoot position."""
-    try:
-        # Get coordinates safely, handling all possible data formats
-        shoulder_x = 0
-        midfoot_x = 0
-        
-        # Get shoulder x-coordinate
-        if isinstance(shoulder, dict):
-            shoulder_x = shoulder.get('x', 0)
-        elif hasattr(shoulder, 'x'):
-            shoulder_x = shoulder.x
-        
-        # Get ankle x-coordinate
-        if isinstance(ankle, dict):
-            midfoot_x = ankle.get('x', 0)
-        elif hasattr(ankle, 'x'):
-            midfoot_x = ankle.x
-            
-        # Return the difference with sign to indicate direction (positive = shoulders in front of midfoot)
-        # which is what we want to detect for forward lean
-        return (shoulder_x - midfoot_x) * 100  # Convert to pixels
-    except Exception as e:
-        app.logger.error(f"Error calculating shoulder-midfoot difference: {str(e)}")
-        return 0  # Default fallback value
+def landmark_confidence_getter(sample_landmark):
+    """Return a cached attrgetter for the confidence field this MediaPipe build exposes.
 
-# --- Utility Functions (Refactored) ---
-def extract_landmarks(pose_landmarks):
-    """Convert MediaPipe pose landmarks to a list of dicts."""
-    return [
-        {'x': lm.x, 'y': lm.y, 'z': lm.z, 'visibility': getattr(lm, 'presence', getattr(lm, 'visibility', 0))}
-        for lm in pose_landmarks
-    ]
+    Older landmark types only carry `visibility`; the tasks API also has `presence`,
+    which we prefer. Resolving it once avoids nested getattr() fallbacks per landmark.
+    """
+    global _landmark_confidence
+    if _landmark_confidence is None:
+        field = 'presence' if hasattr(sample_landmark, 'presence') else 'visibility'
+        _landmark_confidence = operator.attrgetter(field)
+    return _landmark_confidence
 
-def detect_squat_state(session_id, avg_knee_y):
-    """Update and return squat state based on knee position."""
-    if previous_states[session_id] == "standing" and avg_knee_y > 0.6:
-        previous_states[session_id] = "squatting"
-        squat_timings[session_id].append(time.time() - session_start_times[session_id])
-    elif previous_states[session_id] == "squatting" and avg_knee_y < 0.4:
-        previous_states[session_id] = "standing"
-        squat_counts[session_id] += 1
-    return previous_states[session_id]
-
-def generate_feedback(landmarks_list, session_id):
-    """Generate feedback annotations for squat form."""
+def extract_landmarks(pose_landmarks):
+    """Convert MediaPipe pose landmarks to a (33, 4) float32 array of [x, y, z, visibility]."""
+    confidence = landmark_confidence_getter(pose_landmarks[0])
+    return np.array([(lm.x, lm.y, lm.z, confidence(lm)) for lm in pose_landmarks], dtype=np.float32)
+
+def detect_squat_state(session, avg_knee_y):
+    """Update and return the session's squat state based on knee position."""
+    if session.state == "standing" and avg_knee_y > 0.6:
+        session.state = "squatting"
+        session.timings.append(time.time() - session.start)
+    elif session.state == "squatting" and avg_knee_y < 0.4:
+        session.state = "standing"
+        session.count += 1
+    return session.state
+
+def generate_feedback(landmarks, session_id):
+    """Generate feedback annotations for squat form from a (33, 4) landmark array."""
     feedback_list = []
+    # (3, 2) shoulder, hip and knee midpoints
+    midpoints = landmarks[TORSO_PAIRS, :2].astype(np.float64).mean(axis=1)
+    shoulder_midpoint, hip_midpoint, knee_midpoint = midpoints.tolist()
     # Knee alignment
-    knee_hip_alignment = abs((landmarks_list[POSE_LANDMARKS.LEFT_KNEE]['x'] + landmarks_list[POSE_LANDMARKS.RIGHT_KNEE]['x'])/2 -
-                             (landmarks_list[POSE_LANDMARKS.LEFT_HIP]['x'] + landmarks_list[POSE_LANDMARKS.RIGHT_HIP]['x'])/2)
+    knee_hip_alignment = abs(knee_midpoint[0] - hip_midpoint[0])
     if knee_hip_alignment > 0.1:
         feedback_list.append({
             'type': 'annotation',
             'message': 'Keep knees aligned with hips',
             'position': {'start': POSE_LANDMARKS.LEFT_HIP, 'end': POSE_LANDMARKS.LEFT_KNEE, 'textX': 0.1, 'textY': 0.1}
         })
-    # Back angle
-    left_shoulder = landmarks_list[POSE_LANDMARKS.LEFT_SHOULDER]
-    right_shoulder = landmarks_list[POSE_LANDMARKS.RIGHT_SHOULDER]
-    left_hip = landmarks_list[POSE_LANDMARKS.LEFT_HIP]
-    right_hip = landmarks_list[POSE_LANDMARKS.RIGHT_HIP]
-    left_knee = landmarks_list[POSE_LANDMARKS.LEFT_KNEE]
-    right_knee = landmarks_list[POSE_LANDMARKS.RIGHT_KNEE]
-    shoulder_midpoint = [(left_shoulder['x'] + right_shoulder['x'])/2, (left_shoulder['y'] + right_shoulder['y'])/2]
-    hip_midpoint = [(left_hip['x'] + right_hip['x'])/2, (left_hip['y'] + right_hip['y'])/2]
-    knee_midpoint = [(left_knee['x'] + right_knee['x'])/2, (left_knee['y'] + right_knee['y'])/2]
+    # Back angle between the shoulder, hip and knee midpoints
     back_angle = calculate_angle(shoulder_midpoint, hip_midpoint, knee_midpoint)
     if back_angle < 45:
         feedback_list.append({
@@ -325,156 +371,578 @@ def generate_feedback(landmarks_list, session_id):
         })
     return feedback_list
 
+# Small LRU of recent single-frame inference results (with a pose) keyed on the session and
+# a content hash of the frame; /analyze-squat hashes the encoded image so a hit skips decoding
+FRAME_CACHE_SIZE = 64
+_frame_cache = OrderedDict()
+_frame_cache_lock = threading.Lock()
+
+def frame_digest(frame):
+    """Fast content hash of a frame or of encoded image bytes (xxHash when available, BLAKE2 otherwise)."""
+    buf = frame if isinstance(frame, bytes) else np.ascontiguousarray(frame).data
+    if xxhash is not None:
+        return xxhash.xxh64_intdigest(buf)
+    return hashlib.blake2b(buf, digest_size=8).digest()
+
+def cached_detection(cache_key):
+    """Return the cached (landmarks, validator_feedback) for cache_key, or None."""
+    with _frame_cache_lock:
+        cached = _frame_cache.get(cache_key)
+        if cached is not None:
+            _frame_cache.move_to_end(cache_key)
+    return cached
+
+def cache_detection(cache_key, detection):
+    with _frame_cache_lock:
+        _frame_cache[cache_key] = detection
+        if len(_frame_cache) > FRAME_CACHE_SIZE:
+            _frame_cache.popitem(last=False)
+
+def clear_cached_detections(session_id):
+    with _frame_cache_lock:
+        for cache_key in [key for key in _frame_cache if key[0] == session_id]:
+            del _frame_cache[cache_key]
+
+# OpenCV 4.10+ decodes straight to RGB, so live frames skip the BGR->RGB pass
+IMREAD_COLOR_RGB = getattr(cv2, 'IMREAD_COLOR_RGB', None)
+
+# Per-thread RGB scratch frame for live inference; a client's frames all share one size
+_rgb_scratch = threading.local()
+
+def rgb_scratch(shape):
+    """Return this thread's (H, W, 3) uint8 scratch buffer, reallocating only on a size change."""
+    buf = getattr(_rgb_scratch, 'buf', None)
+    if buf is None or buf.shape != shape:
+        buf = _rgb_scratch.buf = np.empty(shape, dtype=np.uint8)
+    return buf
+
+def detect_frame_landmarks(frame, session, is_rgb=False):
+    """Run pose inference (plus the MoveNet cross-check) on a BGR (or, with is_rgb, RGB) frame.
+
+    Returns (landmarks, validator_feedback); landmarks is a (33, 4) array, or None
+    when no pose is found.
+    """
+    if is_rgb:
+        image_rgb = frame
+    else:
+        # The RGB copy is only read during detection (the pose worker copies it into shared
+        # memory), so the thread's scratch buffer can be overwritten by its next frame
+        image_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=rgb_scratch(frame.shape))
+    if pose_worker is not None:
+        detected_poses = pose_worker.detect(image_rgb)
+    else:
+        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=image_rgb)
+        detected_poses = pose_landmarker_global.detect(mp_image).pose_landmarks
+    if not detected_poses:
+        return None, []
+    landmarks = extract_landmarks(detected_poses[0])
+    validator_feedback = []
+    if not MOVENET_VALIDATOR:
+        return landmarks, validator_feedback
+    # ---------- MoveNet cross-check ----------
+    try:
+        # Consecutive frames barely move, so only every MOVENET_STRIDE-th frame of a
+        # session is re-checked and the ones in between reuse its divergence
+        frame_number = session.frame_counter
+        session.frame_counter += 1
+        if frame_number % MOVENET_STRIDE == 0 or session.last_diff_px is None:
+            # Only the sampled frames pay for a BGR copy of an RGB frame
+            mv_kp = infer_pose_bgr(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR) if is_rgb else frame)
+            mp_xy = landmarks[:, :2] * (frame.shape[1], frame.shape[0])
+            session.last_diff_px = np.linalg.norm(mp_xy[5:] - mv_kp[5:, :2], axis=1).mean()
+        diff_px = session.last_diff_px
+        if diff_px > 20:
+            validator_feedback.append({
+                "type": "warning",
+                "message": f"MoveNet and MediaPipe differ (~{diff_px:.1f}px)"
+            })
+    except Exception as e:
+        app.logger.warning(f"MoveNet validator error: {e}")
+    # ------------------------------------------
+    return landmarks, validator_feedback
+
 # --- Refactored analyze_frame ---
-def analyze_frame(frame, session_id=None):
+def analyze_frame(frame, session_id=None, cache_key=None, detection=None, is_rgb=False):
     """
     Analyze a single video frame for squat form and return feedback.
     Args:
-        frame: The video frame (BGR, OpenCV).
+        frame: The video frame (BGR, OpenCV, or RGB with is_rgb); unused when
+            `detection` is given.
         session_id: Optional session identifier.
+        cache_key: Optional frame cache key the caller already looked up (and missed);
+            defaults to one built from the frame's pixels.
+        detection: Optional cached (landmarks, validator_feedback) for this frame.
+        is_rgb: The frame's channels are in RGB order.
     Returns:
         feedback: Dict with landmarks, feedback, squat state, timestamp, etc.
     """
     try:
         if session_id is None:
             session_id = "default"
-        if session_id not in previous_states:
-            previous_states[session_id] = "standing"
-            squat_counts[session_id] = 0
-            squat_timings[session_id] = []
-            session_start_times[session_id] = time.time()
-        image_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=image_rgb)
-        detection_result = pose_landmarker_global.detect(mp_image)
+        session = get_session(session_id)
         feedback = {
             "landmarks": None,
             "feedback": [],
             "skeletonImage": None,
-            "squatState": previous_states[session_id],
-            "timestamp": time.time() - session_start_times[session_id]
+            "squatState": session.state,
+            "timestamp": time.time() - session.start
         }
-        if not detection_result.pose_landmarks:
+        # Resent frames (e.g. a paused video) reuse the previous inference for this session
+        if detection is None and cache_key is None:
+            cache_key = (session_id, frame.shape, frame_digest(frame))
+            detection = cached_detection(cache_key)
+        if detection is None:
+            detection = detect_frame_landmarks(frame, session, is_rgb)
+            if detection[0] is not None:
+                cache_detection(cache_key, detection)
+        landmarks, validator_feedback = detection
+        if landmarks is None:
             return feedback
-        pose_landmarks = detection_result.pose_landmarks[0]
-        # ---------- MoveNet cross-check ----------
-        try:
-            mv_kp = infer_pose_bgr(frame)
-            mp_kp = np.array([[lm.x*frame.shape[1],
-                               lm.y*frame.shape[0],
-                               getattr(lm,'visibility',lm.presence)]
-                              for lm in pose_landmarks])
-            diff_px = np.linalg.norm(mp_kp[5:, :2] - mv_kp[5:, :2], axis=1).mean()
-            if diff_px > 20:
-                feedback["feedback"].append({
-                    "type": "warning",
-                    "message": f"MoveNet and MediaPipe differ (~{diff_px:.1f}px)"
-                })
-        except Exception as e:
-            app.logger.warning(f"MoveNet validator error: {e}")
-        # ------------------------------------------
-        landmarks_list = extract_landmarks(pose_landmarks)
-        feedback["landmarks"] = landmarks_list
-        # Key points
-        left_knee = landmarks_list[POSE_LANDMARKS.LEFT_KNEE]
-        right_knee = landmarks_list[POSE_LANDMARKS.RIGHT_KNEE]
-        left_hip = landmarks_list[POSE_LANDMARKS.LEFT_HIP]
-        right_hip = landmarks_list[POSE_LANDMARKS.RIGHT_HIP]
-        avg_knee_y = (left_knee['y'] + right_knee['y']) / 2
-        feedback["squatState"] = detect_squat_state(session_id, avg_knee_y)
-        feedback["feedback"] = generate_feedback(landmarks_list, session_id)
-        feedback["providers"] = _ort_sess.get_providers()
+        feedback["feedback"] = list(validator_feedback)
+        feedback["landmarks"] = landmark_dicts(landmarks)
+        # With the shoulders, hips or knees occluded (or out of frame) the squat state and
+        # form cues would be computed from guessed positions, so the state is left as is
+        if landmarks[TORSO_PAIRS, 3].min() < FEEDBACK_MIN_VISIBILITY:
+            return feedback
+        avg_knee_y = float(landmarks[KNEES, 1].astype(np.float64).mean())
+        feedback["squatState"] = detect_squat_state(session, avg_knee_y)
+        feedback["feedback"] = generate_feedback(landmarks, session_id)
+        if MOVENET_VALIDATOR:
+            feedback["providers"] = load_movenet_session().get_providers()
         return feedback
     except Exception as e:
         return {"error": f"Frame analysis failed: {str(e)}"}, 500
 
 # --- Refactored analyze_video helpers ---
-def validate_video_metadata(cap, video_file):
-    """Validate and correct video metadata (fps, frame count, duration)."""
-    fps = int(cap.get(cv2.CAP_PROP_FPS))
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    
-    # Detect if video is rotated (mobile portrait mode)
-    is_portrait_video = height > width
-    app.logger.info(f"Video dimensions: {width}x{height}, orientation: {'portrait' if is_portrait_video else 'landscape'}")
-
-    # --- Improved Metadata Validation ---
-    duration_msec = cap.get(cv2.CAP_PROP_POS_MSEC) # Get duration in milliseconds
-    if duration_msec <= 0:
-       cap.set(cv2.CAP_PROP_POS_AVI_RATIO, 1) # Seek to end if needed
-       duration_msec = cap.get(cv2.CAP_PROP_POS_MSEC)
-       cap.set(cv2.CAP_PROP_POS_AVI_RATIO, 0) # Reset to beginning
-    
-    duration_sec = duration_msec / 1000.0 if duration_msec > 0 else 0.0
-    app.logger.info(f"Raw metadata: FPS={fps}, FrameCount={frame_count}, Duration={duration_sec:.2f}s")
-
-    # Validate FPS
-    if fps <= 0 or fps > 120 or fps == 1000: # 1000 is an invalid value often seen
-        app.logger.warning(f"Invalid FPS: {fps}. Attempting recalculation or using default.")
-        if duration_sec > 0 and frame_count > 0 and frame_count < 100000:
-            calculated_fps = frame_count / duration_sec
-            if calculated_fps > 0 and calculated_fps <= 120:
-                fps = round(calculated_fps)
-                app.logger.warning(f"Recalculated FPS based on duration/frameCount: {fps}")
-            else:
-               fps = 30 # Default FPS
-               app.logger.warning(f"Recalculation failed, defaulting FPS to {fps}")
-        else:
-            fps = 30 # Default FPS
-            app.logger.warning(f"Cannot recalculate, defaulting FPS to {fps}")
-    
-    # Validate Frame Count - recalculate if invalid or inconsistent with duration
-    expected_frame_count = int(duration_sec * fps) if duration_sec > 0 and fps > 0 else 0
-    # Check for large negative numbers or zero/small counts if duration is reasonable
-    is_frame_count_invalid = frame_count < 0 or (duration_sec > 0.5 and frame_count <= 1)
-    # Check for significant mismatch with duration
-    is_frame_count_mismatch = expected_frame_count > 0 and abs(frame_count - expected_frame_count) > (expected_frame_count * 0.5)
-    if is_frame_count_invalid or is_frame_count_mismatch:
-        app.logger.warning(f"Invalid/mismatched frame count: {frame_count}. Expected based on duration: ~{expected_frame_count}")
-        if expected_frame_count > 0:
-            frame_count = expected_frame_count
-            app.logger.warning(f"Using frame count calculated from duration: {frame_count}")
-        else:
-             # If duration is also zero, estimate based on file size (rough)
-             file_size_mb = video_file.content_length / (1024 * 1024)
-             estimated_duration = max(1, file_size_mb * 8) # Assume ~8s per MB, min 1s
-             frame_count = int(estimated_duration * fps)
-             app.logger.warning(f"Estimating frame count based on file size: {frame_count}")
+# Analysis budget in seconds of video. Movement phases are time-domain, so a 60 fps
+# clip and a 24 fps clip get the same stretch analysed (50 s = the old 1500 frames at 30 fps)
+MAX_ANALYSIS_SEC = float(os.environ.get('MAX_ANALYSIS_SEC', '50'))
+MIN_ANALYSIS_FRAMES = 10
+# ANALYSIS_FPS=N samples uploaded videos at about N frames per second; the frames in
+# between are grab()bed past without being converted to pixels. 0 (the default) keeps the
+# dense every-frame analysis the overlay animates from.
+ANALYSIS_FPS = float(os.environ.get('ANALYSIS_FPS', '0'))
+
+def clamp_analysis_frames(frame_count, fps):
+    """Clamp the number of frames to analyse to the time budget, logging which bound applied."""
+    max_frames = max(MIN_ANALYSIS_FRAMES, int(MAX_ANALYSIS_SEC * fps))
+    if frame_count > max_frames:
+        app.logger.warning(f"Frame count {frame_count} exceeds the {MAX_ANALYSIS_SEC:.0f}s analysis budget at {fps:.2f} FPS; analysing the first {max_frames} frames")
+        return max_frames
+    if frame_count < MIN_ANALYSIS_FRAMES:
+        app.logger.warning(f"Frame count {frame_count} below the minimum; analysing {MIN_ANALYSIS_FRAMES} frames")
+        return MIN_ANALYSIS_FRAMES
+    return frame_count
+
+class FrameBufferPool:
+    """Small ring of reusable decode buffers for cv2.VideoCapture.
+
+    OpenCV decodes straight into the array passed to read()/retrieve() when its
+    shape and dtype already match, so cycling through a few buffers avoids a fresh
+    (H, W, 3) allocation for every decoded frame. A pooled frame is only valid until
+    the ring wraps around - use detach_frame() before holding on to it.
+    """
+    def __init__(self, size=4):
+        self._buffers = [None] * size
+        self._next = 0
+
+    def _recycle(self, ret, frame):
+        if ret:
+            # Adopt whatever the decoder returned (first use or a resolution change)
+            self._buffers[self._next] = frame
+            self._next = (self._next + 1) % len(self._buffers)
+        return ret, frame
+
+    def read(self, cap):
+        return self._recycle(*cap.read(self._buffers[self._next]))
+
+    def retrieve(self, cap):
+        return self._recycle(*cap.retrieve(self._buffers[self._next]))
+
+def exceeds_size_cap(height, width, is_portrait_video):
+    """True if a decoded frame is over 720x1280 once upright, so it gets halved before inference."""
+    # Size limits apply to the upright frame, so swap the axes for portrait videos
+    upright_h, upright_w = (width, height) if is_portrait_video else (height, width)
+    return upright_h > 720 or upright_w > 1280
+
+def detach_frame(frame, is_portrait_video, color_conversion=cv2.COLOR_BGR2RGB, out=None, downscale=True,
+                 copy=True):
+    """Return an owned, upright, size-capped RGB copy of a (possibly pooled) frame.
+
+    Frames are stored in the form pose inference consumes, so each one is touched
+    once at extraction time. Pass color_conversion=None for sources that already
+    decode to RGB, and downscale=False for ones the decoder already size-capped.
+    `out` is an optional buffer from an earlier frame for the last step to write
+    into; OpenCV allocates a new one if its shape doesn't match. copy=False returns
+    a frame the caller already owns as is when no step had to allocate.
+    """
+    owned = frame
+    # Downscale very large frames to save memory / speed. The half-scale commutes
+    # with the rotation, so it runs first and the rotation only moves the small frame
+    if downscale and exceeds_size_cap(*frame.shape[:2], is_portrait_video):
+        owned = cv2.resize(owned, (0, 0), fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
+    if color_conversion is not None:
+        owned = cv2.cvtColor(owned, color_conversion, dst=None if is_portrait_video else out)
+    # Rotate portrait videos so landmarks are upright
+    if is_portrait_video:
+        owned = cv2.rotate(owned, cv2.ROTATE_90_CLOCKWISE, dst=out)
+    # Nothing allocated: copy out of the pool before the buffer is reused
+    if owned is frame and copy:
+        owned = frame.copy()
+    return owned
+
+# Decode uploaded videos with PyAV when it is installed: FFmpeg then decodes on its
+# own threads with the GIL released. PYAV_DECODE=0 keeps cv2.VideoCapture.
+PYAV_DECODE = av is not None and os.environ.get('PYAV_DECODE', '1') == '1'
+
+class FrameStream:
+    """Decode frames on a background thread into a bounded queue.
+
+    Iterating yields (frame_idx, RGB frame) pairs in frame order while the consumer
+    runs inference, so at most `maxsize` decoded frames are held at any time
+    instead of the whole video. `count` is the number of frames delivered.
+    Frames are read from `cap`, or decoded with PyAV from `video_path` when given;
+    with `pipe_fps` as well, ffmpeg decodes `video_path` at that constant frame rate.
+    With stride > 1 only every stride-th frame is delivered; the others are skipped
+    before colour conversion (or, for the ffmpeg pipe, never output at all).
+
+    With reuse_buffers=True the output frames cycle through a ring of maxsize + 2
+    buffers, so steady-state decoding allocates nothing. That is only safe when the
+    consumer is done with each frame before asking for the next one (the serial
+    inference loop); the ring size covers the queue plus the frame being decoded.
+    """
+    _END = object()
+
+    def __init__(self, cap, frame_count, is_portrait_video, maxsize=16, reuse_buffers=False, video_path=None,
+                 pipe_fps=None, stride=1):
+        self.cap = cap
+        self.video_path = video_path
+        self.pipe_fps = pipe_fps
+        self.stride = stride
+        self.frame_count = frame_count
+        self.is_portrait_video = is_portrait_video
+        self.count = 0
+        self._ring = [None] * (maxsize + 2) if reuse_buffers else None
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._stop = threading.Event()
+        self._error = None
+
+    def _put(self, item):
+        # Time out periodically so an abandoned consumer can't leave the decoder blocked
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _decoded_frames(self):
+        """Yield (frame, color_conversion, downscale) for each decoded frame, in order.
+
+        downscale is False when the decoder has already applied the size cap. Frames
+        skipped by the stride are yielded as None, so positions stay frame indices.
+        """
+        stride = self.stride
+        if self.pipe_fps:
+            # ffmpeg resamples straight to the sampled rate, so nothing is skipped here
+            for frame in read_ffmpeg_frames(self.video_path, self.pipe_fps / stride, -(-self.frame_count // stride),
+                                            self.is_portrait_video):
+                yield frame, None, False
+                for _ in range(stride - 1):
+                    yield None, None, False
+            return
+        if self.video_path is not None:
+            with av.open(self.video_path) as container:
+                video = container.streams.video[0]
+                video.thread_type = 'AUTO'
+                size = {}
+                if exceeds_size_cap(video.height, video.width, self.is_portrait_video):
+                    # swscale halves the frame in the same pass as the RGB conversion
+                    size = {'width': video.width // 2, 'height': video.height // 2, 'interpolation': 'AREA'}
+                for frame_idx, frame in enumerate(container.decode(video)):
+                    if frame_idx % stride:
+                        yield None, None, False
+                        continue
+                    yield frame.to_ndarray(format='rgb24', **size), None, False
+            return
+        pool = FrameBufferPool()
+        frame_idx = 0
+        # grab() only demuxes and decodes; skipped frames never pay for retrieve()'s conversion
+        while self.cap.grab():
+            if frame_idx % stride:
+                frame_idx += 1
+                yield None, None, True
+                continue
+            frame_idx += 1
+            success, frame = pool.retrieve(self.cap)
+            if not success:
+                break
+            yield frame, cv2.COLOR_BGR2RGB, True
+
+    def _produce(self):
+        decoded = self._decoded_frames()
+        delivered = 0
+        try:
+            # range() comes first so nothing is decoded past frame_count
+            for current_idx, (frame, conversion, downscale) in zip(range(self.frame_count), decoded):
+                if self._stop.is_set():
+                    break
+                if frame is None:
+                    continue
+                if self.pipe_fps:
+                    # ffmpeg already sized and rotated it, into a buffer of its own
+                    owned = frame
+                elif self._ring is None:
+                    owned = detach_frame(frame, self.is_portrait_video, conversion, downscale=downscale)
+                else:
+                    # Slots follow delivered frames, not frame indices, so a stride can't alias them
+                    slot = delivered % len(self._ring)
+                    owned = self._ring[slot] = detach_frame(frame, self.is_portrait_video, conversion,
+                                                            out=self._ring[slot], downscale=downscale)
+                self._put((current_idx, owned))
+                delivered += 1
+        except Exception as e:
+            self._error = e
+        finally:
+            decoded.close()
+            self._put(self._END)
 
-    # Ensure frame_count is reasonable after all calculations
-    frame_count = max(10, min(frame_count, 1500)) # Allow slightly more frames, up to 1500
-    # --- End Improved Metadata Validation ---
+    def __iter__(self):
+        decoder = threading.Thread(target=self._produce, name='frame-decoder', daemon=True)
+        decoder.start()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is self._END:
+                    break
+                self.count += 1
+                yield item
+        finally:
+            self._stop.set()
+            decoder.join()
+        if self._error is not None:
+            app.logger.error(f"Frame decoder stopped early: {self._error}")
+
+def read_ffmpeg_frames(video_path, target_fps, max_frames, is_portrait_video=None, every_nth=None):
+    """Decode frames with the ffmpeg binary, streaming raw RGB24 over a pipe.
+
+    Yields (height, width, 3) uint8 arrays, each read straight into a buffer of its
+    own. No shell, no temporary JPEGs: each frame is exactly width*height*3 bytes
+    on ffmpeg's stdout. The stream is resampled to target_fps, unless every_nth is
+    given: then every_nth-th decoded frame is kept as is, so output frame i is
+    source frame i * every_nth. When
+    is_portrait_video is given, ffmpeg's filter graph also applies detach_frame()'s
+    size cap and rotation, so the frames come out ready for inference.
+    """
+    probe = probe_video(video_path)
+    if not probe.width or not probe.height:
+        raise ValueError("ffprobe did not report frame dimensions")
+    # ffmpeg applies the rotation metadata by default, so the output is transposed for 90/270
+    width, height = probe.width, probe.height
+    if probe.rotation in (90, 270):
+        width, height = height, width
+    if every_nth:
+        filters = [f'select=not(mod(n\\,{every_nth}))']
+    else:
+        filters = [f'fps={target_fps}']
+    if is_portrait_video is not None:
+        if exceeds_size_cap(height, width, is_portrait_video):
+            width, height = width // 2, height // 2
+            filters.append(f'scale={width}:{height}:flags=area')
+        if is_portrait_video:
+            filters.append('transpose=clock')
+            width, height = height, width
+    frame_bytes = width * height * 3
 
-    app.logger.info(f"Validated video properties: FPS={fps}, frame_count={frame_count}, duration={duration_sec:.2f}s")
-    
-    return fps, frame_count, width, height, is_portrait_video, duration_sec
+    cmd = [
+        'ffmpeg',
+        '-nostdin',
+        '-v', 'error',
+        '-i', video_path,
+        '-vf', ','.join(filters),
+        # Selected frames are passed on as they are, not duplicated back to the input rate
+        *(['-vsync', 'passthrough'] if every_nth else []),
+        '-f', 'rawvideo',
+        '-pix_fmt', 'rgb24',
+        'pipe:1'
+    ]
+    # stderr goes to a spooled file rather than a second pipe, which nothing would drain
+    # while frames are being read
+    stderr = tempfile.TemporaryFile()
+    proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=stderr)
+    try:
+        for _ in range(max_frames):
+            frame = np.empty((height, width, 3), dtype=np.uint8)
+            if proc.stdout.readinto(memoryview(frame).cast('B')) < frame_bytes:
+                break
+            yield frame
+    finally:
+        proc.stdout.close()
+        stopped_early = proc.poll() is None
+        if stopped_early:
+            proc.kill()
+        proc.wait()
+        if not stopped_early and proc.returncode != 0:
+            stderr.seek(0)
+            app.logger.error(f"ffmpeg exited with {proc.returncode}: "
+                             f"{stderr.read(2048).decode('utf-8', 'replace').strip()}")
+        stderr.close()
+
+def open_capture(video_path):
+    """Open a video with the FFmpeg backend, only falling back to backend auto-detection if it refuses."""
+    cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG)
+    if not cap.isOpened():
+        cap = cv2.VideoCapture(video_path)
+    limit_capture_buffer(cap)
+    return cap
+
+def limit_capture_buffer(cap):
+    """Ask the capture to hold a single decoded frame; returns whether the backend honours it.
+
+    Only some backends (V4L2 and other live sources) keep a frame buffer at all; the
+    FFmpeg file backend decodes on demand and answers False.
+    """
+    return cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
 
-def extract_frames(cap, frame_skip, frame_count, is_portrait_video):
-    """Extract frames sequentially with skipping to improve reliability on codecs where random seeks fail."""
-    frames_to_process = []
-    current_idx = 0
-    success, frame = cap.read()
-    while success and current_idx < frame_count:
-        if current_idx % frame_skip == 0:
-            # Rotate portrait videos so landmarks are upright
-            if is_portrait_video:
-                frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
+@contextlib.contextmanager
+def rewound_capture(video_path, cap=None):
+    """Yield `cap` rewound to the first frame, or a capture of its own that is released afterwards.
 
-            # Downscale very large frames to save memory / speed
-            if frame.shape[0] > 720 or frame.shape[1] > 1280:
-                frame = cv2.resize(frame, (0, 0), fx=0.5, fy=0.5)
+    Lets the fallback extractors share the request's capture instead of each
+    re-opening and re-parsing the container.
+    """
+    if cap is not None and cap.isOpened():
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        yield cap
+        return
+    cap = open_capture(video_path)
+    try:
+        yield cap
+    finally:
+        cap.release()
 
-            frames_to_process.append((current_idx, frame))
+def extract_keyframes(video_path, frame_count, fps, is_portrait_video, max_frames, cap=None):
+    """Seek straight to the video's real keyframes, so no inter-frames have to be decoded.
 
-        # Read next frame
-        success, frame = cap.read()
-        current_idx += 1
+    Falls back to evenly spaced frame seeks when ffprobe can't list the keyframes.
+    """
+    with rewound_capture(video_path, cap) as cap:
+        frames = []
+        pool = FrameBufferPool()
+        keyframe_times = probe_keyframe_times(video_path)
+        if keyframe_times and fps > 0:
+            step = -(-len(keyframe_times) // max_frames)
+            seek_points = [(int(round(t * fps)), cv2.CAP_PROP_POS_MSEC, t * 1000)
+                           for t in keyframe_times[::step]]
+        else:
+            keyframe_interval = max(1, frame_count // min(max_frames, frame_count))
+            seek_points = [(frame_idx, cv2.CAP_PROP_POS_FRAMES, frame_idx)
+                           for frame_idx in range(0, frame_count, keyframe_interval)]
+        for frame_idx, seek_prop, seek_value in seek_points:
+            cap.set(seek_prop, seek_value)
+            ret = cap.grab()
+            if ret:
+                ret, frame = pool.retrieve(cap)
+            if ret:
+                frames.append((frame_idx, detach_frame(frame, is_portrait_video)))
+            if len(frames) >= max_frames:
+                break
+        return frames
+
+def extract_sampled_frames(video_path, frame_count, is_portrait_video, max_frames=200, max_consecutive_failures=30,
+                           cap=None):
+    """Read sequentially, keeping every n-th frame and stepping over short runs of undecodable ones."""
+    with rewound_capture(video_path, cap) as cap:
+        frames = []
+        pool = FrameBufferPool()
+        sample_interval = max(1, frame_count // min(max_frames, frame_count))
+        consecutive_failures = 0
+        for current_idx in range(frame_count):
+            # grab() only demuxes; frames we skip never pay for colour conversion / copy-out
+            ret = cap.grab()
+            if ret and current_idx % sample_interval == 0:
+                ret, frame = pool.retrieve(cap)
+                if ret:
+                    frames.append((current_idx, detach_frame(frame, is_portrait_video)))
+            if ret:
+                consecutive_failures = 0
+            else:
+                consecutive_failures += 1
+                if consecutive_failures >= max_consecutive_failures:
+                    app.logger.warning(f"Too many consecutive failures in sequential reading at frame {current_idx}")
+                    break
+            if len(frames) >= max_frames:
+                break
+        return frames
+
+def extract_ffmpeg_frames(video_path, frame_count, fps, is_portrait_video, max_frames=50):
+    """Decode a thinned-out set of frames with the ffmpeg binary, bypassing OpenCV entirely.
+
+    One ffmpeg process thins out, scales and rotates the frames, so they need no
+    further work in Python.
+    """
+    extraction_interval = max(1, frame_count // min(max_frames, frame_count))
+    # ffmpeg selects every interval-th decoded frame rather than resampling the rate, so
+    # the indices (and the timestamps derived from them) are the frames actually decoded.
+    # Each frame has a buffer of its own, so inference can free them one by one
+    frames = read_ffmpeg_frames(video_path, None, -(-frame_count // extraction_interval) + 2,
+                                is_portrait_video, every_nth=extraction_interval)
+    return [(i * extraction_interval, frame) for i, frame in enumerate(frames)]
+
+def extract_imageio_frames(video_path, frame_count, is_portrait_video):
+    """Decode through imageio's ffmpeg plugin, for hosts without the ffmpeg binary on PATH."""
+    import imageio.v2 as iio
+    reader = iio.get_reader(video_path, format='ffmpeg')  # type: ignore
+    try:
+        # imageio returns RGB numpy arrays
+        return [
+            (idx, detach_frame(frame, is_portrait_video, None))
+            for idx, frame in zip(range(frame_count), reader.iter_data())
+        ]
+    finally:
+        reader.close()
 
-    return frames_to_process
+def extract_frames_best(video_path, frame_count, fps, is_portrait_video, cap=None):
+    """Try the fallback decoders in order of reliability and stop at the first that yields enough frames.
 
-def aggregate_results(processed_frames):
-    """Aggregate results from processed frames and add status information (spine / knee)."""
+    Returns the largest (frame_idx, RGB frame) list any of them produced, in frame order.
+    The OpenCV decoders rewind and reuse `cap` when given an open one.
+    """
+    enough = min(60, frame_count // 2)
+    # Up to ten seconds' worth of frames, spread over the whole video
+    budget = max(1, int(10 * fps))
+    extractors = [
+        ('Keyframe', lambda: extract_keyframes(video_path, frame_count, fps, is_portrait_video, budget, cap=cap)),
+        ('Sequential', lambda: extract_sampled_frames(video_path, frame_count, is_portrait_video, cap=cap)),
+        ('imageio', lambda: extract_imageio_frames(video_path, frame_count, is_portrait_video))
+    ]
+    if frame_count < 120:  # ~4 seconds at 30 fps – keep things simple, no seeking
+        extractors = extractors[1:]
+    # One ffmpeg pipe decodes, resamples, scales and rotates in a single pass, without
+    # OpenCV's seeks; the OpenCV and imageio decoders are only tried after it
+    if shutil.which('ffmpeg'):
+        extractors.insert(0, ('FFmpeg', lambda: extract_ffmpeg_frames(video_path, frame_count, fps, is_portrait_video, budget)))
+
+    best = []
+    for name, extract in extractors:
+        try:
+            frames = extract()
+        except Exception as e:
+            app.logger.error(f"{name} extraction failed: {str(e)}")
+            continue
+        app.logger.info(f"{name} extraction method yielded {len(frames)} frames")
+        if len(frames) > len(best):
+            best = frames
+        if len(best) >= enough:
+            break
+    return best
+
+def aggregate_results(processed_frames, lm_stack, depth_ratios):
+    """Add status information (spine / knee) to the processed frames.
+
+    Row i of the (N, 33, 4) `lm_stack` and of the `depth_ratios` column
+    (NaN where unknown) belong to processed_frames[i].
+    """
     
     # Thresholds (degrees for spine, ratio for depth). DepthRatio coming from measurements is scaled *100 – normalize first.
     SPINE_GOOD = 45
@@ -482,85 +950,47 @@ def aggregate_results(processed_frames):
     DEPTH_GOOD = 0.85
     DEPTH_WARN = 0.6
 
-    pose = POSE_LANDMARKS  # alias for readability
+    if not processed_frames:
+        return processed_frames
 
-    for f in processed_frames:
-        # Default statuses
-        spine_status = knee_status = 'warn'
+    # ---- Spine status from the torso/back angle, knee status from the depth ratio
+    spine_codes, knee_codes = squat_kernels.frame_statuses(
+        lm_stack, depth_ratios, (SPINE_GOOD, SPINE_WARN), (DEPTH_GOOD, DEPTH_WARN))
 
-        try:
-            # Retrieve landmarks & measurements
-            lm = f.get('landmarks') or []
-            meas = f.get('measurements') or {}
-
-            # ---- Spine status (torso/back angle)
-            back_angle = None
-            if len(lm) > pose.RIGHT_KNEE:
-                # Prefer right side for consistency, fallback to left
-                rs, rh, rk = pose.RIGHT_SHOULDER, pose.RIGHT_HIP, pose.RIGHT_KNEE
-                ls, lh, lk = pose.LEFT_SHOULDER, pose.LEFT_HIP, pose.LEFT_KNEE
-
-                def ok(idx):
-                    return idx < len(lm) and lm[idx]['visibility'] >= 0.5
-
-                if ok(rs) and ok(rh) and ok(rk):
-                    back_angle = calculate_angle(lm[rs], lm[rh], lm[rk])
-                elif ok(ls) and ok(lh) and ok(lk):
-                    back_angle = calculate_angle(lm[ls], lm[lh], lm[lk])
-
-            if back_angle is not None:
-                if back_angle <= SPINE_GOOD:
-                    spine_status = 'good'
-                elif back_angle <= SPINE_WARN:
-                    spine_status = 'warn'
-                else:
-                    spine_status = 'bad'
-            else:
-                spine_status = 'warn'  # Unknown – treat as warn
-
-            # ---- Knee / depth status
-            depth_raw = meas.get('depthRatio')
-            if depth_raw is not None:
-                # Un-scale if necessary (>1 implies percentage *100)
-                depth_ratio = depth_raw / 100 if depth_raw > 1.5 else depth_raw
-                if depth_ratio >= DEPTH_GOOD:
-                    knee_status = 'good'
-                elif depth_ratio >= DEPTH_WARN:
-                    knee_status = 'warn'
-                else:
-                    knee_status = 'bad'
-            else:
-                knee_status = 'warn'
-
-        except Exception as e:
-            app.logger.error(f"aggregate_results status calc error: {str(e)}")
-            spine_status = knee_status = 'warn'
-
-        # Attach status object
+    # Attach status objects
+    labels = squat_kernels.STATUS_LABELS
+    for f, spine, knee in zip(processed_frames, spine_codes.tolist(), knee_codes.tolist()):
         f['status'] = {
-            'spine': spine_status,
-            'knee': knee_status
+            'spine': labels[spine],
+            'knee': labels[knee]
         }
 
     return processed_frames
 
-def get_video_properties(video_path):
-    """Uses ffprobe to get video duration and frame count."""
+# Everything analyze_video needs from one ffprobe run; fields are None when unknown
+VideoProbe = namedtuple('VideoProbe', 'duration frame_count fps width height rotation')
+
+@functools.lru_cache(maxsize=128)
+def _probe_video(video_path, file_size, file_mtime_ns):
+    """Run ffprobe once for a given file version (size/mtime are only part of the cache key)."""
     cmd = [
         'ffprobe',
         '-v', 'error',
         '-select_streams', 'v:0',
-        '-show_entries', 'stream=duration,nb_frames,r_frame_rate',
-        '-of', 'json',
+        '-show_streams',
+        '-show_format',
+        '-print_format', 'json',
         video_path
     ]
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=30)
         data = json.loads(result.stdout)
-        stream_data = data.get('streams', [{}])[0]
+        stream_data = (data.get('streams') or [{}])[0]
+        format_data = data.get('format') or {}
         
-        duration_str = stream_data.get('duration')
-        duration = float(duration_str) if duration_str else None
+        # WebM/MKV streams often only carry the container-level duration
+        duration_str = stream_data.get('duration') or format_data.get('duration')
+        duration = float(duration_str) if duration_str and duration_str != 'N/A' else None
         
         nb_frames_str = stream_data.get('nb_frames')
         # nb_frames can be 'N/A' for some formats/streams
@@ -586,16 +1016,86 @@ def get_video_properties(video_path):
         elif duration is None and nb_frames is not None and fps is not None and fps > 0:
             duration = nb_frames / fps
             app.logger.warning(f"ffprobe missing duration, estimated as {duration:.2f}s from nb_frames/fps")
+
+        width = stream_data.get('width')
+        height = stream_data.get('height')
+        # Phone recordings store orientation either as a legacy tag or as display-matrix side data
+        rotation = 0
+        try:
+            rotate_tag = (stream_data.get('tags') or {}).get('rotate')
+            if rotate_tag is not None:
+                rotation = int(rotate_tag) % 360
+            else:
+                for side_data in stream_data.get('side_data_list') or []:
+                    if 'rotation' in side_data:
+                        rotation = int(side_data['rotation']) % 360
+                        break
+        except (ValueError, TypeError):
+            rotation = 0
             
-        app.logger.info(f"ffprobe results: duration={duration}, nb_frames={nb_frames}, fps={fps}")
-        return duration, nb_frames, fps
+        app.logger.info(f"ffprobe results: duration={duration}, nb_frames={nb_frames}, fps={fps}, size={width}x{height}, rotation={rotation}")
+        return VideoProbe(duration, nb_frames, fps, width, height, rotation)
         
     except subprocess.CalledProcessError as e:
         app.logger.error(f"ffprobe error: {e.stderr}")
-        return None, None, None
     except Exception as e:
         app.logger.error(f"Error parsing ffprobe output: {e}")
-        return None, None, None
+    return VideoProbe(None, None, None, None, None, 0)
+
+def probe_video(video_path):
+    """Cached ffprobe metadata for a video file; re-probes only if the file changes."""
+    stat = os.stat(video_path)
+    return _probe_video(video_path, stat.st_size, stat.st_mtime_ns)
+
+@functools.lru_cache(maxsize=128)
+def _probe_keyframe_times(video_path, file_size, file_mtime_ns):
+    """Keyframe timestamps (seconds) from ffprobe, which only decodes the keyframes themselves."""
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-skip_frame', 'nokey',
+        '-show_entries', 'frame=best_effort_timestamp_time',
+        '-print_format', 'csv=p=0',
+        video_path
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=30)
+        times = []
+        for line in result.stdout.splitlines():
+            value = line.strip().rstrip(',')
+            if value and value != 'N/A':
+                times.append(float(value))
+        return tuple(sorted(times))
+    except subprocess.CalledProcessError as e:
+        app.logger.error(f"ffprobe keyframe listing error: {e.stderr}")
+    except Exception as e:
+        app.logger.error(f"Error listing keyframes with ffprobe: {e}")
+    return ()
+
+def probe_keyframe_times(video_path):
+    """Cached keyframe timestamps for a video file; empty when ffprobe can't list them."""
+    stat = os.stat(video_path)
+    return _probe_keyframe_times(video_path, stat.st_size, stat.st_mtime_ns)
+
+def get_video_properties(video_path):
+    """Uses ffprobe to get video duration and frame count."""
+    probe = probe_video(video_path)
+    return probe.duration, probe.frame_count, probe.fps
+
+# Knee Depth Scoring Utility
+def calc_depth_score(angle, hip_below_knee=False):
+    """Return a score (0-100) for the deepest knee angle reached.
+
+    Full marks for very deep squats (70° or less, or hip below knee), none for
+    shallow squats of 90° or more, linear in between. Per-frame scoring uses
+    the vectorised equivalent in squat_kernels.
+    """
+    if hip_below_knee or angle <= 70:
+        return 100.0
+    if angle >= 90:
+        return 0.0
+    return ((90 - angle) / 20.0) * 100.0
 
 # New Hip Flexion Scoring Utility
 def calc_hip_flexion_score(angle):
@@ -635,28 +1135,367 @@ def calc_pelvic_tilt_score(delta_angle):
         return 0.0
     return (15 - delta_angle) / 10.0 * 100.0
 
-def calculate_pelvic_angle(lm):
-    """Approximate pelvic/trunk angle (°) in the sagittal plane using hip & shoulder centres.
-    0° means perfectly vertical trunk, positive values = leaning forward.
+# Landmarks kept in video payloads: shoulders, arms, torso, hips, legs - no facial features
+RELEVANT_LANDMARKS = [
+    POSE_LANDMARKS.LEFT_SHOULDER, POSE_LANDMARKS.RIGHT_SHOULDER,
+    POSE_LANDMARKS.LEFT_ELBOW, POSE_LANDMARKS.RIGHT_ELBOW,
+    POSE_LANDMARKS.LEFT_WRIST, POSE_LANDMARKS.RIGHT_WRIST,
+    POSE_LANDMARKS.LEFT_HIP, POSE_LANDMARKS.RIGHT_HIP,
+    POSE_LANDMARKS.LEFT_KNEE, POSE_LANDMARKS.RIGHT_KNEE,
+    POSE_LANDMARKS.LEFT_ANKLE, POSE_LANDMARKS.RIGHT_ANKLE,
+    POSE_LANDMARKS.LEFT_HEEL, POSE_LANDMARKS.RIGHT_HEEL,
+    POSE_LANDMARKS.LEFT_FOOT_INDEX, POSE_LANDMARKS.RIGHT_FOOT_INDEX
+]
+RELEVANT_MASK = np.zeros(33, dtype=bool)
+RELEVANT_MASK[RELEVANT_LANDMARKS] = True
+LANDMARK_FIELDS = ('x', 'y', 'z', 'visibility')
+# ?landmarkFormat values for the compact landmark block, and their little-endian dtypes
+LANDMARK_BLOB_DTYPES = {'float16': '<f2', 'float32': '<f4'}
+
+def landmark_dicts(landmarks):
+    """The wire format for a (33, 4) landmark array (or its tolist()): a list of {x, y, z, visibility} dicts."""
+    if isinstance(landmarks, np.ndarray):
+        landmarks = landmarks.tolist()
+    return [dict(zip(LANDMARK_FIELDS, row)) for row in landmarks]
+
+def process_frame(frame_data, fps, current_phase='down', landmarker=None):
+    """Run pose inference on one (frame_idx, RGB frame) pair and build its frame payload.
+
+    Returns the payload dict (measurements are filled in later, in batch), or None
+    when no pose is detected. `landmarker` is a VideoLandmarker checked out for the
+    current segment; without one the IMAGE-mode global landmarker is used. Lives at module
+    scope so video inference workers can run it with their own landmarker.
     """
-    try:
-        sh_l, sh_r = lm[POSE_LANDMARKS.LEFT_SHOULDER], lm[POSE_LANDMARKS.RIGHT_SHOULDER]
-        hip_l, hip_r = lm[POSE_LANDMARKS.LEFT_HIP], lm[POSE_LANDMARKS.RIGHT_HIP]
-    except (IndexError, KeyError, TypeError):
+    # Frames arrive already RGB, size-capped and contiguous from detach_frame()
+    frame_idx, frame_rgb = frame_data
+
+    # Memory is tracked by the request's RSSSampler, not per frame on this hot path
+    mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=frame_rgb)
+    if landmarker is not None:
+        # VIDEO mode: timestamps follow the frame's position in the video
+        detection_result = landmarker.detect(mp_image, int(frame_idx * 1000 / fps))
+    else:
+        # Use the global landmarker (reduces per‑frame memory usage)
+        detection_result = pose_landmarker_global.detect(mp_image)
+    if not detection_result.pose_landmarks:
         return None
 
-    shoulder_cx = (sh_l['x'] + sh_r['x']) / 2.0
-    shoulder_cy = (sh_l['y'] + sh_r['y']) / 2.0
-    hip_cx = (hip_l['x'] + hip_r['x']) / 2.0
-    hip_cy = (hip_l['y'] + hip_r['y']) / 2.0
+    pose_landmarks = detection_result.pose_landmarks[0]
+
+    # One (33, 4) [x, y, z, visibility] row per frame; only the tracked rows are written,
+    # the facial rows stay zero (RELEVANT_MASK says which is which)
+    lm = np.zeros((33, 4), dtype=np.float32)
+    lm[RELEVANT_LANDMARKS] = [(p.x, p.y, p.z, p.visibility) for p in map(pose_landmarks.__getitem__, RELEVANT_LANDMARKS)]
+
+    # Knee, hip flexion and pelvic angles, depth ratio and shoulder-midfoot diff are
+    # all computed across every frame at once after inference (see squat_kernels)
+
+    # E. kneesVisible is filled in by the batched pass too, from the same joint mask
+    return {
+        # Landmark array for the batched pass, which fills the measurements and
+        # expands it into the 'landmarks' dicts; popped before the response
+        '_lm': lm,
+        'frame': frame_idx,
+        'timestamp': frame_idx / fps,
+        'measurements': {
+            'kneeAngle': None,
+            'depthRatio': None,
+            'shoulderMidfootDiff': None,
+            'hipFlexionAngle': None,
+            'pelvicAngle': None
+        },
+        'arrows': [],
+        'kneesVisible': None,
+        'status': {
+            'spine': 'ok',
+            'knee': 'ok',
+            'current_phase': current_phase
+        }
+    }
 
-    dx = hip_cx - shoulder_cx
-    dy = hip_cy - shoulder_cy  # positive downwards in image coords
-    if dy == 0:
-        return 0.0
-    # atan2 returns radians; convert to degrees.  We measure angle from vertical axis.
-    angle = math.degrees(math.atan2(dx, dy))
-    return angle
+try:
+    _malloc_trim = ctypes.CDLL('libc.so.6').malloc_trim
+except (OSError, AttributeError):  # not glibc; freed heap pages are left to the allocator
+    _malloc_trim = None
+
+def release_memory():
+    """Collect garbage cycles, then hand the heap pages freed by a large request back to the OS."""
+    gc.collect()
+    if _malloc_trim is not None:
+        _malloc_trim(0)
+
+def consume_frames(frames):
+    """Yield the items of a frame list while clearing their slots, so each decoded frame is freed once used."""
+    for i in range(len(frames)):
+        item, frames[i] = frames[i], None
+        yield item
+
+class RSSSampler:
+    """Sample this process's RSS on a background thread while a request runs.
+
+    Keeps /proc reads and log records out of the per-frame loops; the samples sit
+    in a ring buffer and are summarised in a single [MEM_DIAG] line on stop().
+    """
+    def __init__(self, label, interval=1.0, maxlen=600):
+        self.label = label
+        self.interval = interval
+        self.samples = deque(maxlen=maxlen)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        process = psutil.Process()
+        t0 = time.time()
+        while True:
+            self.samples.append((time.time() - t0, process.memory_info().rss / 1024 / 1024))
+            if self._stop.wait(self.interval):
+                break
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f'rss-sampler-{self.label}', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.samples:
+            peak_t, peak_mb = max(self.samples, key=operator.itemgetter(1))
+            app.logger.warning(
+                f"[MEM_DIAG] {self.label}: peak RSS={peak_mb:.1f} MB at {peak_t:.1f}s, "
+                f"last={self.samples[-1][1]:.1f} MB ({len(self.samples)} samples)"
+            )
+
+# Frames whose 32x32 greyscale thumbnail differs from the last analysed frame by less
+# than this sum of absolute differences reuse its pose instead of re-running inference.
+# Off (0) by default, as reused poses can shift the scores; 2000 is ~2 grey levels per pixel.
+DUPLICATE_FRAME_SAD = int(os.environ.get('DUPLICATE_FRAME_SAD', '0'))
+
+class DuplicateFrameGate:
+    """Spot frames that are near-identical to the last frame that was actually analysed."""
+    def __init__(self, threshold=DUPLICATE_FRAME_SAD):
+        self.threshold = threshold
+        self._reference = None
+
+    def is_duplicate(self, frame_rgb):
+        if self.threshold <= 0:
+            return False
+        small = cv2.resize(cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2GRAY), (32, 32), interpolation=cv2.INTER_AREA)
+        # Compare against the last *kept* frame so slow motion can't creep past the gate
+        if self._reference is not None and cv2.norm(small, self._reference, cv2.NORM_L1) < self.threshold:
+            return True
+        self._reference = small
+        return False
+
+def reuse_frame_result(prev_result, frame_idx, fps):
+    """Copy a frame result for a near-duplicate frame, re-stamped with the new frame index."""
+    if prev_result is None:
+        return None
+    result = dict(prev_result)
+    result.update(
+        frame=frame_idx,
+        timestamp=frame_idx / fps,
+        # Later scoring writes into these per frame, so they must not be shared
+        measurements=dict(prev_result['measurements']),
+        arrows=list(prev_result['arrows']),
+        status=dict(prev_result['status'])
+    )
+    return result
+
+def process_frames_gated(frames, fps, current_phase, landmarker=None):
+    """Yield process_frame() results in order, skipping inference for near-duplicate frames.
+
+    `landmarker` is a caller-owned landmarker to use; without one, each call is one
+    ordered segment for a VIDEO-mode landmarker from the pool (or the global one).
+    """
+    gate = DuplicateFrameGate()
+    prev_result = None
+    if landmarker is not None:
+        segment = contextlib.nullcontext(landmarker)
+    elif video_landmarkers is not None:
+        segment = video_landmarkers.segment()
+    else:
+        segment = contextlib.nullcontext()
+    with segment as landmarker:
+        for frame_data in frames:
+            if gate.is_duplicate(frame_data[1]):
+                yield reuse_frame_result(prev_result, frame_data[0], fps)
+            else:
+                prev_result = process_frame(frame_data, fps, current_phase, landmarker)
+                yield prev_result
+
+# OpenCV's own thread pool (resize / cvtColor / rotate in detach_frame) otherwise sizes
+# itself to every core in each gunicorn worker, on top of the decoder and TFLite threads;
+# cap it per process. CV_THREADS=0 leaves OpenCV's default.
+CV_THREADS = int(os.environ.get('CV_THREADS', str(max(1, (os.cpu_count() or 4) // 2))))
+if CV_THREADS > 0:
+    cv2.setNumThreads(CV_THREADS)
+
+# Optional process pool for video pose inference. Each (spawned) worker imports this
+# module and so owns its own landmarker; every worker also holds its own model copy,
+# so keep this at 1 (serial, in-process) on memory-constrained hosts.
+VIDEO_INFERENCE_WORKERS = int(os.environ.get('VIDEO_INFERENCE_WORKERS', '1'))
+_video_pool = None
+_video_pool_lock = threading.Lock()
+
+# In-process alternative: INFERENCE_THREADS > 1 runs frame chunks on that many threads
+# (MediaPipe releases the GIL while it runs the graph). Chunks from one video land on
+# different threads, so VIDEO-mode tracking couldn't carry across them; instead each
+# thread owns an IMAGE-mode landmarker for its lifetime, i.e. INFERENCE_THREADS extra
+# models per process however many videos are in flight.
+INFERENCE_THREADS = int(os.environ.get('INFERENCE_THREADS', '1'))
+THREADED_INFERENCE = INFERENCE_THREADS > 1
+_inference_threads = None
+_inference_local = threading.local()
+_inference_landmarkers = []
+
+def _init_video_worker():
+    # The pool provides the parallelism; keep OpenCV from oversubscribing each core
+    cv2.setNumThreads(1)
+    # Spawned workers inherit DEFER_MODEL_LOAD from a preloading arbiter
+    load_models()
+
+def _process_frame_chunk(chunk, fps, current_phase):
+    return list(process_frames_gated(chunk, fps, current_phase))
+
+def _init_inference_thread():
+    _inference_local.landmarker = ImageLandmarker(model_path)
+    with _video_pool_lock:
+        _inference_landmarkers.append(_inference_local.landmarker)
+
+def _process_frame_chunk_threaded(chunk, fps, current_phase):
+    return list(process_frames_gated(chunk, fps, current_phase, _inference_local.landmarker))
+
+def _close_inference_landmarkers():
+    with _video_pool_lock:
+        for landmarker in _inference_landmarkers:
+            landmarker.close()
+        _inference_landmarkers.clear()
+
+def _process_frame_range(video_path, start, stop, fps, is_portrait_video, current_phase, stride=1):
+    """Decode frames [start, stop) of a video and run inference on them in a pool worker.
+
+    Returns (results, frames_decoded). The worker seeks and decodes for itself, so
+    no frame has to cross the process boundary. Only frames whose index is a
+    multiple of `stride` are retrieved and analysed; frames_decoded counts those.
+    """
+    cap = open_capture(video_path)
+    decoded = 0
+
+    def frames():
+        nonlocal decoded
+        pool = FrameBufferPool()
+        for frame_idx in range(start, stop):
+            if not cap.grab():
+                return
+            if frame_idx % stride:
+                continue
+            success, frame = pool.retrieve(cap)
+            if not success:
+                return
+            decoded += 1
+            yield frame_idx, detach_frame(frame, is_portrait_video)
+
+    try:
+        if start:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        results = [r for r in process_frames_gated(frames(), fps, current_phase) if r is not None]
+        return results, decoded
+    finally:
+        cap.release()
+
+def process_video_parallel(video_path, frame_count, fps, is_portrait_video, current_phase, stride=1):
+    """Split a video into one contiguous frame range per pool worker and merge the results in order.
+
+    Returns (results, frames_decoded), like a FrameStream run through process_frames_gated.
+    """
+    pool = get_video_pool()
+    bounds = np.linspace(0, frame_count, VIDEO_INFERENCE_WORKERS + 1).astype(int).tolist()
+    futures = [
+        pool.submit(_process_frame_range, video_path, start, stop, fps, is_portrait_video, current_phase, stride)
+        for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start
+    ]
+    results = []
+    decoded = 0
+    for future in futures:
+        range_results, range_decoded = future.result()
+        results.extend(range_results)
+        decoded += range_decoded
+    return results, decoded
+
+def get_video_pool():
+    """Create the video inference pool on first use."""
+    global _video_pool
+    with _video_pool_lock:
+        if _video_pool is None:
+            _video_pool = ProcessPoolExecutor(
+                max_workers=VIDEO_INFERENCE_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_video_worker
+            )
+    return _video_pool
+
+def get_inference_threads():
+    """Create the in-process inference thread pool on first use."""
+    global _inference_threads
+    with _video_pool_lock:
+        if _inference_threads is None:
+            _inference_threads = ThreadPoolExecutor(max_workers=INFERENCE_THREADS, thread_name_prefix='pose',
+                                                    initializer=_init_inference_thread)
+            atexit.register(_close_inference_landmarkers)
+    return _inference_threads
+
+def process_frames_parallel(frames, fps, current_phase, chunk_len=16, threads=False):
+    """Fan frames out to the inference pool in contiguous chunks and merge results in frame order.
+
+    `frames` may be any iterable, including a FrameStream; only a couple of chunks
+    per worker are in flight, so the input is never materialised all at once.
+    threads=True uses the in-process thread pool instead of the worker processes.
+    """
+    pool = get_inference_threads() if threads else get_video_pool()
+    run_chunk = _process_frame_chunk_threaded if threads else _process_frame_chunk
+    max_in_flight = (INFERENCE_THREADS if threads else VIDEO_INFERENCE_WORKERS) * 2
+    frames = iter(frames)
+    pending = deque()
+    results = []
+    for chunk in iter(lambda: list(islice(frames, chunk_len)), []):
+        pending.append(pool.submit(run_chunk, chunk, fps, current_phase))
+        # Futures are drained in submission order, so the merged list stays sorted by frame
+        if len(pending) >= max_in_flight:
+            results.extend(r for r in pending.popleft().result() if r is not None)
+    while pending:
+        results.extend(r for r in pending.popleft().result() if r is not None)
+    return results
+
+def dump_json(obj):
+    """Serialise to JSON bytes: orjson (also handles NumPy values) when installed, else the json module."""
+    if orjson is None:
+        return json.dumps(obj).encode()
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+
+def json_response(payload):
+    """A JSON response serialised with dump_json (orjson when installed) instead of jsonify's json module."""
+    return app.response_class(dump_json(payload), mimetype='application/json')
+
+def streamed_json_response(payload, list_key, chunk_len=64):
+    """Stream `payload` as JSON, serialising the (large) list under `list_key` a chunk of items at a time.
+
+    The full response body is never held in memory at once; the client sees the
+    other keys first, then the list.
+    """
+    items = payload[list_key]
+    head = dump_json({key: value for key, value in payload.items() if key != list_key})
+    list_open = (b'{' if head == b'{}' else head[:-1] + b',') + dump_json(list_key) + b':['
+
+    def generate():
+        yield list_open
+        for start in range(0, len(items), chunk_len):
+            chunk = b','.join(dump_json(item) for item in items[start:start + chunk_len])
+            yield (b',' + chunk) if start else chunk
+        yield b']}'
+
+    return app.response_class(stream_with_context(generate()), mimetype='application/json')
 
 @app.route('/', methods=['GET'])
 def home():
@@ -685,13 +1524,23 @@ def analyze_squat():
         # Remove header if present and decode base64 image data.
         image_data = data['image'].split(",")[-1]
         image_bytes = base64.b64decode(image_data)
-        image = Image.open(io.BytesIO(image_bytes))
-        frame = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+        # A re-sent image (e.g. during a network stall) is answered from the frame cache
+        # without being decoded again
+        cache_key = (session_id, frame_digest(image_bytes))
+        detection = cached_detection(cache_key)
+        frame = None
+        if detection is None:
+            # Straight to RGB (or BGR before OpenCV 4.10) in one decode; EXIF orientation
+            # is ignored, as PIL did
+            frame = cv2.imdecode(np.frombuffer(image_bytes, np.uint8),
+                                 (IMREAD_COLOR_RGB or cv2.IMREAD_COLOR) | cv2.IMREAD_IGNORE_ORIENTATION)
+            if frame is None:
+                raise ValueError("unsupported or corrupt image data")
     except Exception as e:
         return jsonify({"error": f"Error processing image: {str(e)}"}), 500
 
-    feedback = analyze_frame(frame, session_id)
-    return jsonify(feedback)
+    feedback = analyze_frame(frame, session_id, cache_key, detection, is_rgb=IMREAD_COLOR_RGB is not None)
+    return json_response(feedback)
 
 @app.route('/reset-session', methods=['POST'])
 def reset_session():
@@ -699,10 +1548,10 @@ def reset_session():
     session_id = data.get('sessionId', 'default')
     
     # Reset session data and record the start time for alignment
-    previous_states[session_id] = "standing"
-    squat_counts[session_id] = 0
-    squat_timings[session_id] = []
-    session_start_times[session_id] = time.time()
+    with _sessions_lock:
+        sessions.pop(session_id, None)
+    get_session(session_id)
+    clear_cached_detections(session_id)
     
     return jsonify({"success": True, "message": f"Session {session_id} reset successfully"})
 
@@ -710,13 +1559,14 @@ def reset_session():
 def get_session_data():
     session_id = request.args.get('sessionId', 'default')
     
-    if session_id not in previous_states:
+    session = get_session(session_id, create=False)
+    if session is None:
         return jsonify({"error": "Session not found"}), 404
     
     session_data = {
-        "squatCount": squat_counts.get(session_id, 0),
-        "squatTimings": squat_timings.get(session_id, []),
-        "currentState": previous_states.get(session_id, "standing")
+        "squatCount": session.count,
+        "squatTimings": session.timings,
+        "currentState": session.state
     }
     
     return jsonify(session_data)
@@ -724,13 +1574,184 @@ def get_session_data():
 # Set a high max upload size (100MB)
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB
 
+def finalize_analysis(results, lm_stack, measurement_columns, original_duration, original_fps,
+                      original_frame_count, t_start):
+    """Timestamps, squat phases, per-frame and summary scores for the inferred frames.
+
+    `results` must be sorted by frame, with row i of `lm_stack` and of each
+    measurement column belonging to results[i]. Returns the /analyze response body.
+    """
+    # --- Timestamp scaling ---
+    if original_duration and original_duration > 0 and len(results) > 1:
+        # Use the timestamp of the last processed frame
+        last_ts = results[-1]['timestamp']
+        if last_ts > 0:
+            diff_ratio = abs(last_ts - original_duration) / original_duration
+            # Scale when mismatch ≥1%
+            if diff_ratio >= 0.01:
+                scale_factor = original_duration / last_ts
+                for r in results:
+                    r['timestamp'] *= scale_factor
+                app.logger.info(
+                    f"Timestamp scaled by factor {scale_factor:.3f} (orig_dur={original_duration:.2f}s, last_ts={last_ts:.2f}s, diff={diff_ratio:.2%})"
+                )
+
+    # Timestamps are frame_idx / fps, scaled by one positive factor at most, so frame
+    # order is already timestamp order and no second sort is needed
+    if app.debug:
+        assert all(a['timestamp'] <= b['timestamp'] for a, b in zip(results, results[1:]))
+
+    # --- Calculate Per-Frame Scores ---
+    # First, identify actual squat phases (ignore standing)
+    squat_phases = []
+    in_squat = False
+    for i, frame in enumerate(results):
+        status = frame.get('status')
+        if status is None:
+            continue
+        is_down = status.get('current_phase') == 'down'
+        # Start squat on 'down' phase
+        if is_down and not in_squat:
+            in_squat = True
+            squat_phases.append({'start': i, 'frames': []})
+        # End squat when back to standing (phase = none)
+        elif not is_down and in_squat:
+            in_squat = False
+            squat_phases[-1]['end'] = i
+        # Add frame to current squat if in squat
+        if in_squat:
+            squat_phases[-1]['frames'].append(i)
+
+    # Complete any open squat phases
+    if in_squat and len(squat_phases) > 0:
+        squat_phases[-1]['end'] = len(results) - 1
+
+    # Track global best depth
+    global_min_knee_angle = 180  # Track best depth across all squats
+
+    # Scores are kept as columns (one row per frame) and only turned into the per-frame
+    # dicts once at the end
+    no_measurements = np.full(len(results), np.nan)
+    knee = measurement_columns.get('kneeAngle', no_measurements)
+    shoulder = measurement_columns.get('shoulderMidfootDiff', no_measurements)
+    hip_flexion = measurement_columns.get('hipFlexionAngle', no_measurements)
+    pelvic = measurement_columns.get('pelvicAngle', no_measurements)
+    score_keys = ('knee_depth', 'shoulder_align', 'hip_flexion', 'pelvic_tilt', 'overall', 'phase')
+    score_table = np.empty((len(results), len(score_keys)))
+    scored = np.zeros(len(results), dtype=bool)
+
+    # Progressive scores per squat phase, computed on the measurement columns in one
+    # vectorised pass per phase; each phase starts from the scores the previous one ended on
+    if squat_phases:
+        hip_below_knee = squat_kernels.hips_below_knees(lm_stack)
+        carry = (0.0, 100.0, 0.0, 100.0)
+        for phase_idx, phase in enumerate(squat_phases):
+            phase_frames = slice(phase['start'], phase.get('end', len(results) - 1) + 1)
+            scores = squat_kernels.score_phase(
+                knee[phase_frames], shoulder[phase_frames], hip_flexion[phase_frames],
+                pelvic[phase_frames], hip_below_knee[phase_frames], carry
+            )
+            score_table[phase_frames, :5] = scores
+            score_table[phase_frames, 5] = phase_idx + 1
+            scored[phase_frames] = True
+            carry = tuple(scores[-1, :4])
+
+            phase_knee = knee[phase_frames][~np.isnan(knee[phase_frames])]
+            if phase_knee.size:
+                global_min_knee_angle = min(global_min_knee_angle, float(phase_knee.min()))
+            if app.logger.isEnabledFor(logging.DEBUG):
+                app.logger.debug("Squat %d: frames %d-%d, best knee angle %s, scores at end %s",
+                                 phase_idx + 1, phase_frames.start, phase_frames.stop - 1,
+                                 phase_knee.min() if phase_knee.size else None,
+                                 dict(zip(score_keys, scores[-1].tolist())))
+
+    # Frames outside squat phases repeat the last scores seen (phase number included);
+    # nothing mutates the score dicts afterwards, so such runs share one dict
+    prev_scores = {'knee_depth':0.0,'shoulder_align':100.0,'hip_flexion':0.0,'pelvic_tilt':100.0,'overall':0.0,'phase':0}
+    for frame, row, is_scored in zip(results, score_table.tolist(), scored.tolist()):
+        if is_scored:
+            prev_scores = dict(zip(score_keys, row))
+            prev_scores['phase'] = int(row[5])
+        frame['scores'] = prev_scores
+
+    # For API backward compatibility - calculate final scores from best squat
+    best_knee_depth = 0.0
+    best_shoulder_align = 0.0
+    best_hip_flexion = 0.0
+    best_pelvic_tilt = 0.0
+    best_overall = 0.0
+
+    # Find the best frame scores across all frames
+    squat_frames = np.fromiter((i for phase in squat_phases for i in phase.get('frames', [])), dtype=np.int64)
+    if squat_frames.size:
+        squat_scores = score_table[squat_frames]
+        best_overall = float(squat_scores[:, 4].max())
+
+        # Recalculate score based on global min knee angle
+        best_knee_depth = round(calc_depth_score(global_min_knee_angle), 1)
+
+        # Worst shoulder alignment, best hip flexion and worst pelvic tilt over the squat frames
+        best_shoulder_align = float(squat_scores[:, 1].min())
+        best_hip_flexion = float(squat_scores[:, 2].max())
+        best_pelvic_tilt = float(squat_scores[:, 3].min())
+
+    # --- Secondary fallback: derive from raw measurements when no score computed ---
+    # A depth or shoulder score of 0 from an actual squat is a real result, not a gap
+    if best_knee_depth == 0.0 and not squat_frames.size:
+        knee_angles = knee[~np.isnan(knee)]
+        if knee_angles.size:
+            best_knee_depth = round(calc_depth_score(float(knee_angles.min())), 1)
+
+    if best_shoulder_align == 0.0 and not squat_frames.size:
+        shoulder_diffs = np.abs(shoulder[~np.isnan(shoulder)])
+        if shoulder_diffs.size:
+            worst_diff = float(shoulder_diffs.max())
+            if worst_diff >= 10:
+                best_shoulder_align = 0.0
+            else:
+                best_shoulder_align = round((10 - worst_diff) / 8 * 100.0, 1)
+
+    if best_hip_flexion == 0.0:
+        hip_flexion_angles = hip_flexion[~np.isnan(hip_flexion)]
+        if hip_flexion_angles.size:
+            best_hip_flexion = float(squat_kernels.hip_flexion_scores(hip_flexion_angles).max())
+
+    if best_pelvic_tilt == 100.0:
+        pelvic_angles = pelvic[~np.isnan(pelvic)]
+        if pelvic_angles.size:
+            best_pelvic_tilt = float(squat_kernels.pelvic_tilt_scores(np.abs(pelvic_angles)).min())
+
+    # Calculate final overall score using the best scores
+    overall_score = round(best_knee_depth * 0.4 + best_shoulder_align * 0.3 + best_hip_flexion * 0.2 + best_pelvic_tilt * 0.1, 1)
+
+    # --- Assemble Final Result ---
+    analysis_result = {
+        # Use original FPS if available, else the backend default (30)
+        'fps': original_fps if original_fps is not None and original_fps > 0 else 30,
+        'frames': aggregate_results(results, lm_stack, measurement_columns.get('depthRatio')),
+        'analysisDuration': time.time() - t_start,
+        'totalFramesProcessed': len(results),
+        'originalDuration': original_duration, # Add original duration info
+        'originalFrameCount': original_frame_count, # Add original frame count info
+        'scores': {
+            'kneeDepthScore': best_knee_depth,
+            'shoulderAlignmentScore': best_shoulder_align,
+            'hipFlexionScore': best_hip_flexion,
+            'pelvicTiltScore': best_pelvic_tilt,
+            'overall': overall_score
+        }
+    }
+    return analysis_result
+
+
 @app.route('/analyze', methods=['POST', 'OPTIONS'])
 @cross_origin()
 def analyze_video():
     import psutil, os, time
     process = psutil.Process(os.getpid())
-    rss_mb = process.memory_info().rss / 1024 / 1024
-    app.logger.warning(f"[MEM_DIAG] ENTRY: RSS={rss_mb:.1f} MB, PID={os.getpid()}, time={time.time()}")
+    if MEM_DIAG:
+        rss_mb = process.memory_info().rss / 1024 / 1024
+        app.logger.warning(f"[MEM_DIAG] ENTRY: RSS={rss_mb:.1f} MB, PID={os.getpid()}, time={time.time()}")
     t_start = time.time()
     # Minimize debug logging - log only critical info
     app.logger.info(f"Received /analyze request: method={request.method}, size={request.content_length or 0}")
@@ -765,68 +1786,46 @@ def analyze_video():
     temp_dir = tempfile.gettempdir()
     temp_filename = f"temp_{uuid.uuid4().hex}{orig_ext}"
     temp_path = os.path.join(temp_dir, temp_filename)
-    # Ensure pointer at start before saving
-    file.seek(0)
-    file.save(temp_path)
-    rss_mb = process.memory_info().rss / 1024 / 1024
-    app.logger.warning(f"[MEM_DIAG] AFTER FILE SAVE: RSS={rss_mb:.1f} MB, time={time.time() - t_start:.2f}s")
-
-    # --- Re-encode to constant FPS MP4 if needed (e.g., variable-FPS WebM) ---
-    need_transcode = orig_ext in ('.webm', '.mkv', '.avi')
-    if need_transcode:
-        mp4_temp = os.path.join(temp_dir, f"temp_{uuid.uuid4().hex}.mp4")
-        ffmpeg_cmd = [
-            'ffmpeg', '-y', '-i', temp_path,
-            '-c:v', 'libx264', '-pix_fmt', 'yuv420p',
-            '-r', '30', '-movflags', '+faststart', mp4_temp
-        ]
-        try:
-            subprocess.run(ffmpeg_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
-            app.logger.info(f"Transcoded video to constant-FPS MP4: {mp4_temp}")
-            # Replace original path with transcoded path for further processing
-            os.remove(temp_path)
-            temp_path = mp4_temp
-            orig_ext = '.mp4'
-        except Exception as ff_err:
-            app.logger.warning(f"FFmpeg transcode failed, continuing with original file. Error: {ff_err}")
+    # The upload was already spooled to a named temp file (see DiskUploadRequest), so
+    # move it into place; copy it instead if it lives elsewhere or isn't a named file
+    try:
+        os.replace(file.stream.name, temp_path)
+    except (AttributeError, TypeError, OSError):
+        file.seek(0)
+        file.save(temp_path)
+    if MEM_DIAG:
+        rss_mb = process.memory_info().rss / 1024 / 1024
+        app.logger.warning(f"[MEM_DIAG] AFTER FILE SAVE: RSS={rss_mb:.1f} MB, time={time.time() - t_start:.2f}s")
+
+    # --- Variable-FPS containers (e.g. WebM) are resampled to a constant 30 fps ---
+    # ffmpeg decodes them straight into the frame stream over a pipe (see FrameStream),
+    # so there is no intermediate MP4 to encode, write and decode again
+    pipe_fps = 30 if orig_ext in ('.webm', '.mkv', '.avi') and shutil.which('ffmpeg') else None
     # ------------------------------------------------------
 
     # --- Get Original Video Properties using ffprobe --- 
     original_duration, original_frame_count, original_fps = get_video_properties(temp_path)
+    if pipe_fps:
+        # Timestamps follow the resampled stream, not the container's own frame rate
+        original_fps = pipe_fps
+        original_frame_count = int(original_duration * pipe_fps) if original_duration else None
     if original_duration is None or original_duration <= 0 or original_frame_count is None or original_frame_count <= 0:
         app.logger.warning("Could not get reliable duration/frame count via ffprobe. Timestamps might be inaccurate.")
-        # Use OpenCV as fallback? For now, proceed but warn.
-        # Let's try to get *something* from OpenCV if ffprobe failed completely
-        cap_check = cv2.VideoCapture(temp_path)
-        if cap_check.isOpened():
-            if original_frame_count is None or original_frame_count <= 0:
-                 ocv_frames = int(cap_check.get(cv2.CAP_PROP_FRAME_COUNT))
-                 if ocv_frames > 0:
-                      original_frame_count = ocv_frames
-                      app.logger.warning(f"Using OpenCV frame count as fallback: {original_frame_count}")
-            if original_duration is None:
-                ocv_fps = cap_check.get(cv2.CAP_PROP_FPS)
-                if ocv_fps is not None and ocv_fps > 0 and original_frame_count is not None and original_frame_count > 0:
-                    original_duration = original_frame_count / ocv_fps
-                    app.logger.warning(f"Using OpenCV duration as fallback: {original_duration:.2f}s")        
-            cap_check.release()
-        # If still no valid duration/frame count, we have a problem for timestamping
-        if original_duration is None or original_duration <= 0 or original_frame_count is None or original_frame_count <= 0:
-             app.logger.error("FATAL: Cannot determine video duration or frame count for accurate timestamping.")
-             # Perhaps default duration to avoid crashing? Set to arbitrary 10s?
-             original_duration = 10.0 # Arbitrary default
-             original_frame_count = 300 # Arbitrary default (assumes 30fps for 10s)
-             app.logger.error(f"Defaulting to arbitrary duration={original_duration}s, frame_count={original_frame_count}")
-             # Fallback failed, maybe return error?
-             # return jsonify({'error': 'Could not determine video properties for analysis.'}), 500
+    # Remember what was actually measured before any fallbacks or arbitrary defaults kick in
+    probed_duration = original_duration if original_duration and original_duration > 0 else None
+    probed_frame_count = original_frame_count if original_frame_count and original_frame_count > 0 else None
     # ------------------------------------------------------
 
+    # RSS is sampled once a second off the request thread and summarised at the end
+    rss_sampler = RSSSampler('analyze').start() if MEM_DIAG else None
     try:
         app.logger.info(f"Processing video at {temp_path}")
         # Log memory usage before processing
-        process = psutil.Process(os.getpid())
-        mem_mb = process.memory_info().rss / 1024 / 1024
-        app.logger.info(f"[MEMORY] Before extraction: {mem_mb:.2f} MB")
+        if MEM_DIAG:
+            mem_mb = process.memory_info().rss / 1024 / 1024
+            app.logger.info(f"[MEMORY] Before extraction: {mem_mb:.2f} MB")
+        # Set when the upload turns out to be a still image: video processing is skipped
+        goto_processing = False
         # Initialize video capture (explicitly request FFMPEG backend for better codec support)
         # Try multiple video backends if first one fails
         cap = cv2.VideoCapture(temp_path, cv2.CAP_FFMPEG)
@@ -840,16 +1839,15 @@ def analyze_video():
                 # Try to read as a static image instead (fallback for corrupted videos)
                 try:
                     # Try to use PIL to open the file (more lenient)
-                    from PIL import Image
+                    from PIL import Image, UnidentifiedImageError
                     try:
-                        img = Image.open(temp_path)
-                        img_array = np.array(img)
-                        if img_array is not None and img_array.size > 0:
-                            # Convert PIL image to OpenCV BGR format if needed
-                            if len(img_array.shape) == 3 and img_array.shape[2] == 3:
-                                frame = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
-                            else:
-                                frame = img_array
+                        with Image.open(temp_path) as img:
+                            img.load()
+                            # Frames are analysed as RGB; only greyscale/alpha/palette images need converting
+                            img_array = np.asarray(img if img.mode == 'RGB' else img.convert('RGB'))
+                        if img_array.size > 0:
+                            # np.asarray already copied the pixels out of PIL
+                            frame = detach_frame(img_array, False, None, copy=False)
                                 
                             app.logger.warning(f"Processed file as static image instead of video: {temp_path}")
                             # Create an array with just this one frame
@@ -858,295 +1856,127 @@ def analyze_video():
                             goto_processing = True
                         else:
                             raise ValueError("Empty image array")
-                    except Exception as img_err:
-                        app.logger.error(f"Failed to open as image too: {str(img_err)}")
+                    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError) as img_err:
+                        app.logger.error(f"Failed to open as image too ({type(img_err).__name__}): {str(img_err)}")
                         return jsonify({'error': 'No file uploaded'}), 400
                 except Exception as fallback_err:
                     app.logger.error(f"All fallback attempts failed: {str(fallback_err)}")
                     return jsonify({'error': 'Could not open video file – file may be corrupted or in an unsupported format'}), 400
             else:
                 app.logger.warning(f"Opened with default backend instead of FFMPEG: {temp_path}")
-        
-        # Store flag to skip video processing if we used the image fallback
-        goto_processing = False
-        
-        # Get video properties
-        fps = int(cap.get(cv2.CAP_PROP_FPS))
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        
-        # Detect if video is rotated (mobile portrait mode)
-        is_portrait_video = height > width
-        app.logger.info(f"Video dimensions: {width}x{height}, orientation: {'portrait' if is_portrait_video else 'landscape'}")
-
-        # --- Improved Metadata Validation ---
-        duration_msec = cap.get(cv2.CAP_PROP_POS_MSEC) # Get duration in milliseconds
-        if duration_msec <= 0:
-           cap.set(cv2.CAP_PROP_POS_AVI_RATIO, 1) # Seek to end if needed
-           duration_msec = cap.get(cv2.CAP_PROP_POS_MSEC)
-           cap.set(cv2.CAP_PROP_POS_AVI_RATIO, 0) # Reset to beginning
-        
-        duration_sec = duration_msec / 1000.0 if duration_msec > 0 else 0.0
-        app.logger.info(f"Raw metadata: FPS={fps}, FrameCount={frame_count}, Duration={duration_sec:.2f}s")
-
-        # Validate FPS
-        if fps <= 0 or fps > 120 or fps == 1000: # 1000 is an invalid value often seen
-            app.logger.warning(f"Invalid FPS: {fps}. Attempting recalculation or using default.")
-            if duration_sec > 0 and frame_count > 0 and frame_count < 100000:
-                calculated_fps = frame_count / duration_sec
-                if calculated_fps > 0 and calculated_fps <= 120:
-                    fps = round(calculated_fps)
-                    app.logger.warning(f"Recalculated FPS based on duration/frameCount: {fps}")
-                else:
-                   fps = 30 # Default FPS
-                   app.logger.warning(f"Recalculation failed, defaulting FPS to {fps}")
+        if cap.isOpened():
+            app.logger.info(f"Capture buffer limited to one frame: {limit_capture_buffer(cap)}")
+
+        if goto_processing:
+            # A single still frame: nothing to probe, and the frame is analysed as is
+            fps = 30
+            frame_count = 1
+            duration_sec = 0.0
+            is_portrait_video = False
+        else:
+            # Get video properties from the ffprobe run above; the capture is only used for
+            # decoding, and its header values only fill in what ffprobe couldn't report
+            probe = probe_video(temp_path)
+            if probe.width and probe.height:
+                width, height = probe.width, probe.height
+                # OpenCV auto-rotates phone recordings, so use the dimensions it decodes at
+                if probe.rotation in (90, 270):
+                    width, height = height, width
             else:
-                fps = 30 # Default FPS
-                app.logger.warning(f"Cannot recalculate, defaulting FPS to {fps}")
+                width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+                height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            fps = pipe_fps or (int(probe.fps) if probe.fps else int(cap.get(cv2.CAP_PROP_FPS)))
+            frame_count = probed_frame_count or int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+            if probed_frame_count is None and frame_count > 0:
+                original_frame_count = frame_count
+                app.logger.warning(f"Using OpenCV frame count as fallback: {original_frame_count}")
+            if probed_duration is None:
+                ocv_fps = cap.get(cv2.CAP_PROP_FPS)
+                if ocv_fps > 0 and original_frame_count is not None and original_frame_count > 0:
+                    original_duration = original_frame_count / ocv_fps
+                    app.logger.warning(f"Using OpenCV duration as fallback: {original_duration:.2f}s")
+            # If still no valid duration/frame count, we have a problem for timestamping
+            if original_duration is None or original_duration <= 0 or original_frame_count is None or original_frame_count <= 0:
+                app.logger.error("FATAL: Cannot determine video duration or frame count for accurate timestamping.")
+                original_duration = 10.0 # Arbitrary default
+                original_frame_count = 300 # Arbitrary default (assumes 30fps for 10s)
+                app.logger.error(f"Defaulting to arbitrary duration={original_duration}s, frame_count={original_frame_count}")
+
+            # Detect if video is rotated (mobile portrait mode)
+            is_portrait_video = height > width
+            app.logger.info(f"Video dimensions: {width}x{height}, orientation: {'portrait' if is_portrait_video else 'landscape'}")
+
+            # --- Improved Metadata Validation ---
+            # Duration comes from ffprobe above; asking OpenCV would mean seeking to the end and back
+            duration_sec = probed_duration or 0.0
+            duration_source = 'ffprobe' if duration_sec > 0 else 'unknown'
+            if duration_sec <= 0 and frame_count > 0 and 0 < fps <= 120:
+                duration_sec = frame_count / fps
+                duration_source = 'frame count/FPS'
+            app.logger.info(f"Duration {duration_sec:.2f}s (source: {duration_source})")
+            app.logger.info(f"Raw metadata: FPS={fps}, FrameCount={frame_count}, Duration={duration_sec:.2f}s")
+
+            # Validate FPS
+            if fps <= 0 or fps > 120 or fps == 1000: # 1000 is an invalid value often seen
+                app.logger.warning(f"Invalid FPS: {fps}. Attempting recalculation or using default.")
+                if duration_sec > 0 and frame_count > 0 and frame_count < 100000:
+                    calculated_fps = frame_count / duration_sec
+                    if calculated_fps > 0 and calculated_fps <= 120:
+                        fps = round(calculated_fps)
+                        app.logger.warning(f"Recalculated FPS based on duration/frameCount: {fps}")
+                    else:
+                       fps = 30 # Default FPS
+                       app.logger.warning(f"Recalculation failed, defaulting FPS to {fps}")
+                else:
+                    fps = 30 # Default FPS
+                    app.logger.warning(f"Cannot recalculate, defaulting FPS to {fps}")
         
-        # Validate Frame Count - recalculate if invalid or inconsistent with duration
-        expected_frame_count = int(duration_sec * fps) if duration_sec > 0 and fps > 0 else 0
-        # Check for large negative numbers or zero/small counts if duration is reasonable
-        is_frame_count_invalid = frame_count < 0 or (duration_sec > 0.5 and frame_count <= 1)
-        # Check for significant mismatch with duration
-        is_frame_count_mismatch = expected_frame_count > 0 and abs(frame_count - expected_frame_count) > (expected_frame_count * 0.5)
-        if is_frame_count_invalid or is_frame_count_mismatch:
-            app.logger.warning(f"Invalid/mismatched frame count: {frame_count}. Expected based on duration: ~{expected_frame_count}")
-            if expected_frame_count > 0:
-                frame_count = expected_frame_count
-                app.logger.warning(f"Using frame count calculated from duration: {frame_count}")
+            # Validate Frame Count - recalculate if invalid or inconsistent with duration
+            expected_frame_count = int(duration_sec * fps) if duration_sec > 0 and fps > 0 else 0
+            # Check for large negative numbers or zero/small counts if duration is reasonable
+            is_frame_count_invalid = frame_count < 0 or (duration_sec > 0.5 and frame_count <= 1)
+            # Check for significant mismatch with duration. OpenCV's CAP_PROP_FRAME_COUNT is often
+            # far off for MP4s, so it is only trusted within 50% of duration*fps; ffprobe's count
+            # is authoritative and a disagreement with it is only logged
+            frame_count_gap = abs(frame_count - expected_frame_count)
+            if probed_frame_count is not None:
+                is_frame_count_mismatch = False
+                if expected_frame_count > 0 and frame_count_gap > expected_frame_count * 0.2:
+                    app.logger.warning(f"ffprobe frame count {frame_count} disagrees with duration*fps ~{expected_frame_count}; keeping ffprobe's")
             else:
-                 # If duration is also zero, estimate based on file size (rough)
-                 file_size_mb = file.content_length / (1024 * 1024)
-                 estimated_duration = max(1, file_size_mb * 8) # Assume ~8s per MB, min 1s
-                 frame_count = int(estimated_duration * fps)
-                 app.logger.warning(f"Estimating frame count based on file size: {frame_count}")
+                is_frame_count_mismatch = expected_frame_count > 0 and frame_count_gap > (expected_frame_count * 0.5)
+            if is_frame_count_invalid or is_frame_count_mismatch:
+                app.logger.warning(f"Invalid/mismatched frame count: {frame_count}. Expected based on duration: ~{expected_frame_count}")
+                if expected_frame_count > 0:
+                    frame_count = expected_frame_count
+                    app.logger.warning(f"Using frame count calculated from duration: {frame_count}")
+                else:
+                     # If duration is also zero, estimate based on file size (rough)
+                     file_size_mb = file.content_length / (1024 * 1024)
+                     estimated_duration = max(1, file_size_mb * 8) # Assume ~8s per MB, min 1s
+                     frame_count = int(estimated_duration * fps)
+                     app.logger.warning(f"Estimating frame count based on file size: {frame_count}")
 
-        # Ensure frame_count is reasonable after all calculations
-        frame_count = max(10, min(frame_count, 1500)) # Allow slightly more frames, up to 1500
-        # --- End Improved Metadata Validation ---
+            # Ensure frame_count is reasonable after all calculations
+            frame_count = clamp_analysis_frames(frame_count, fps)
+            # --- End Improved Metadata Validation ---
 
         app.logger.info(f"Validated video properties: FPS={fps}, frame_count={frame_count}, duration={duration_sec:.2f}s")
         
-        # Force dense frame processing for smoother overlay – process every frame
-        frame_skip = 1  # Always analyse every frame
-        app.logger.info(f"Frame skip forced to {frame_skip} for dense analysis")
+        # Dense frame processing for a smooth overlay - every frame - unless ANALYSIS_FPS
+        # asks for sampling, in which case only every frame_skip-th frame is decoded to pixels
+        frame_skip = max(1, int(round(fps / ANALYSIS_FPS))) if ANALYSIS_FPS > 0 else 1
+        app.logger.info(f"Frame skip {frame_skip} ({'dense analysis' if frame_skip == 1 else f'~{fps / frame_skip:.1f} fps sampled'})")
 
-        # Pre-calculate target frame indices (all frames)
-        target_frames = list(range(0, frame_count, frame_skip))
-        
-        # Skip if we already have frames from image fallback
-        if not goto_processing:
-            # Extract frames to process with robust multi-method approach
-            frames_to_process = []
-            
-            # Try multiple methods for frame extraction in order of reliability
-            # Choose extraction strategies based on video length
-            if frame_count < 120:  # ~4 seconds at 30 fps – keep things simple
-                extraction_methods = [
-                    "sequential_reading",
-                    "ffmpeg_frames"
-                ]
-            else:
-                extraction_methods = [
-                    "keyframe_extraction",
-                    "sequential_reading",
-                    "ffmpeg_frames"
-                ]
-            
-            # Pre-calculate target frames as a set for faster lookup
-            target_frame_set = set(target_frames)
-            
-            # First method: Keyframe extraction - often works better with certain codecs
-            if "keyframe_extraction" in extraction_methods:
-                app.logger.info("Trying keyframe extraction method first")
-                keyframe_frames = []
-                
-                # Release and reopen the capture to ensure clean state
-                cap.release()
-                cap = cv2.VideoCapture(temp_path)
-                
-                # Get video properties again
-                fps = cap.get(cv2.CAP_PROP_FPS)
-                frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-                
-                # Calculate interval between keyframes (aim for up to 180 frames)
-                max_keyframes = min(180, len(target_frames))
-                keyframe_interval = max(1, frame_count // max_keyframes)
-                
-                # Extract keyframes at regular intervals
-                for frame_idx in range(0, frame_count, keyframe_interval):
-                    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-                    ret, frame = cap.read()
-                    if ret:
-                        # Handle rotated video from mobile devices
-                        if is_portrait_video:
-                            frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
-                        keyframe_frames.append((frame_idx, frame))
-                    if len(keyframe_frames) >= max_keyframes:
-                        break
-                        
-                app.logger.info(f"Keyframe extraction method yielded {len(keyframe_frames)} frames")
-                if len(keyframe_frames) >= min(60, len(target_frames) // 2):
-                    frames_to_process = keyframe_frames
-                    app.logger.info("Using keyframe extraction results")
-            
-            # Second method: Sequential reading if first method didn't yield enough frames
-            if len(frames_to_process) < min(60, len(target_frames) // 2) and "sequential_reading" in extraction_methods:
-                app.logger.info("Trying sequential reading method")
-                
-                # Release and reopen the capture to ensure clean state
-                cap.release()
-                cap = cv2.VideoCapture(temp_path)
-                
-                # Reset to beginning of video for sequential reading
-                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-                
-                sequential_frames = []
-                consecutive_failures = 0
-                max_consecutive_failures = 30  # Increased threshold
-                frames_read = 0
-                current_idx = 0
-                sample_interval = max(1, frame_count // min(200, len(target_frames)))
-                
-                # Read frames sequentially, sampling at regular intervals
-                while frames_read < frame_count:
-                    # Only process frames at our sampling interval
-                    if current_idx % sample_interval == 0:
-                        ret, frame = cap.read()
-                        if ret:
-                            if is_portrait_video:
-                                frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
-                            sequential_frames.append((current_idx, frame))
-                            consecutive_failures = 0
-                        else:
-                            consecutive_failures += 1
-                            if consecutive_failures >= max_consecutive_failures:
-                                app.logger.warning(f"Too many consecutive failures in sequential reading at frame {current_idx}")
-                                break
-                    else:
-                        # Skip frames we're not interested in
-                        ret = cap.grab()
-                        if not ret:
-                            consecutive_failures += 1
-                            if consecutive_failures >= max_consecutive_failures:
-                                break
-                    
-                    current_idx += 1
-                    frames_read += 1
-                    
-                    # Exit if we have enough frames
-                    if len(sequential_frames) >= min(200, len(target_frames)):
-                        break
-                
-                app.logger.info(f"Sequential reading method yielded {len(sequential_frames)} frames")
-                if len(sequential_frames) > len(frames_to_process):
-                    frames_to_process = sequential_frames
-                    app.logger.info("Using sequential reading results")
-            
-            # Third method: Try using FFmpeg directly as a last resort
-            if len(frames_to_process) < min(20, len(target_frames) // 4) and "ffmpeg_frames" in extraction_methods:
-                try:
-                    app.logger.info("Trying FFmpeg direct extraction as last resort")
-                    # Create a temp directory for extracted frames
-                    with tempfile.TemporaryDirectory() as tmpdirname:
-                        # Use FFmpeg to extract frames
-                        extract_count = min(50, frame_count)
-                        extraction_interval = max(1, frame_count // extract_count)
-                        # Use a simpler approach with -r to avoid filter syntax issues
-                        target_fps = max(1, min(30, int(fps / extraction_interval)))
-                        ffmpeg_cmd = f"ffmpeg -i {temp_path} -r {target_fps} -q:v 1 {tmpdirname}/frame_%04d.jpg"
-                        os.system(ffmpeg_cmd)
-                        
-                        # Load the extracted frames
-                        ffmpeg_frames = []
-                        frame_files = sorted([f for f in os.listdir(tmpdirname) if f.startswith('frame_')])
-                        for i, frame_file in enumerate(frame_files):
-                            frame_path = os.path.join(tmpdirname, frame_file)
-                            frame = cv2.imread(frame_path)
-                            if frame is not None:
-                                frame_idx = i * extraction_interval
-                                if is_portrait_video:
-                                    frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
-                                ffmpeg_frames.append((frame_idx, frame))
-                        
-                        app.logger.info(f"FFmpeg extraction method yielded {len(ffmpeg_frames)} frames")
-                        if len(ffmpeg_frames) > len(frames_to_process):
-                            frames_to_process = ffmpeg_frames
-                            app.logger.info("Using FFmpeg extraction results")
-                except Exception as e:
-                    app.logger.error(f"FFmpeg extraction failed: {str(e)}")
-            
-            # Fourth method: imageio fallback when ffmpeg binary not available
-            if len(frames_to_process) < min(10, len(target_frames) // 4):
-                try:
-                    import imageio.v2 as iio
-                    app.logger.info("Trying imageio reader fallback extraction")
-                    reader = iio.get_reader(temp_path, format='ffmpeg')  # type: ignore
-                    imgio_frames = []
-                    for idx, frame in enumerate(reader.iter_data()):
-                        if idx >= frame_count:
-                            break
-                        if idx % frame_skip != 0:
-                            continue
-                        # imageio returns RGB numpy array
-                        frame_bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-                        if is_portrait_video:
-                            frame_bgr = cv2.rotate(frame_bgr, cv2.ROTATE_90_CLOCKWISE)
-                        imgio_frames.append((idx, frame_bgr))
-                        if len(imgio_frames) >= len(target_frames):
-                            break
-                    app.logger.info(f"imageio extraction yielded {len(imgio_frames)} frames")
-                    if len(imgio_frames) > len(frames_to_process):
-                        frames_to_process = imgio_frames
-                        app.logger.info("Using imageio extraction results")
-                except Exception as e:
-                    app.logger.error(f"imageio extraction failed: {str(e)}")
- 
-            # Final assessment of frame extraction results
-            app.logger.info(f"Final frame extraction yielded {len(frames_to_process)} frames out of target {len(target_frames)}")
-            
-            # If we got fewer than expected frames but still have some to work with
-            if len(frames_to_process) < len(target_frame_set) / 2:
-                app.logger.warning(f"Extracted only {len(frames_to_process)} frames out of {len(target_frame_set)} target frames, but continuing with available frames")
-                
-            # Fallback: if coverage <80%, do a simple sequential read of all frames
-            coverage = len(frames_to_process) / max(1, len(target_frame_set))
-            if coverage < 0.8:
-                app.logger.warning(
-                    f"Frame coverage {coverage:.1%} below 80%. Falling back to sequential extraction of all frames."
-                )
-                # Reopen capture
-                cap.release()
-                cap = cv2.VideoCapture(temp_path)
-                frames_to_process = extract_frames(cap, 1, frame_count, is_portrait_video)
-                app.logger.info(f"Sequential fallback extracted {len(frames_to_process)} frames")
-            
-            # Sort frames by index to ensure chronological order
-            frames_to_process.sort(key=lambda x: x[0])
-            
-            # Resize frames to reduce memory usage if they're large
-            for i, (idx, frame) in enumerate(frames_to_process):
-                if frame.shape[0] > 720 or frame.shape[1] > 1280:
-                    frames_to_process[i] = (idx, cv2.resize(frame, (0, 0), fx=0.5, fy=0.5))
-        
-        # Release the capture as soon as we've extracted frames
-        cap.release()
-        
-        app.logger.info(f"Extracted {len(frames_to_process)} frames for processing")
-        # Log memory usage after frame extraction
-        mem_mb = process.memory_info().rss / 1024 / 1024
-        app.logger.info(f"[MEMORY] After extraction: {mem_mb:.2f} MB")
-        rss_mb = process.memory_info().rss / 1024 / 1024
-        app.logger.warning(f"[MEM_DIAG] AFTER FRAME EXTRACTION: RSS={rss_mb:.1f} MB, time={time.time() - t_start:.2f}s")
+        # Number of target frames (every frame_skip-th one); only the count is ever needed
+        num_targets = -(-frame_count // frame_skip)
         
-        # Define function to process a single frame
         # ---- Squat phase tracking variables ----
         # We want to show certain feedback (e.g., "Squat deeper") only during the descent.
         # Track the knee angle progression across frames to infer movement direction.
         in_squat = False  # Always consider as not in a squat for simpler logic
-        squat_phases = [{"start": 0, "end": max(0, len(frames_to_process) - 1)}]  # Treat the whole video as one squat
+        squat_phases = [{"start": 0, "end": max(0, frame_count - 1)}]  # Treat the whole video as one squat
         prev_knee_angle = 180
         prev_hip_y = 0
         current_phase = 'down'    # Always consider in 'down' phase to capture lowest angle
@@ -1157,541 +1987,147 @@ def analyze_video():
         
         current_squat_min_knee = 180.0  # track lowest knee angle in ongoing squat
 
-        def process_frame(frame_data):
-            nonlocal prev_knee_angle, prev_hip_y, current_phase, current_squat_min_knee
-            frame_idx, frame = frame_data
-            
-            # Convert BGR to RGB
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
-            # Ensure the array is C-contiguous, which can sometimes help with external libraries
-            frame_rgb_contiguous = np.ascontiguousarray(frame_rgb)
-
-            # Log before pose inference
-            rss_mb = process.memory_info().rss / 1024 / 1024
-            app.logger.warning(f"[MEM_DIAG] BEFORE POSE INFERENCE: RSS={rss_mb:.1f} MB, frame={frame_idx}, time={time.time() - t_start:.2f}s")
-            mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=frame_rgb_contiguous) # Use contiguous array
-            # Use the global landmarker (reduces per‑frame memory usage)
-            detection_result = pose_landmarker_global.detect(mp_image)
-            rss_mb = process.memory_info().rss / 1024 / 1024
-            app.logger.warning(f"[MEM_DIAG] AFTER POSE INFERENCE: RSS={rss_mb:.1f} MB, frame={frame_idx}, time={time.time() - t_start:.2f}s")
-            if not detection_result.pose_landmarks:
-                return None
-                
-            pose_landmarks = detection_result.pose_landmarks[0]
-            
-            # Define the relevant landmarks for squat analysis
-            # Only include shoulders, arms, torso, hips, legs - exclude facial features
-            relevant_landmark_indices = [
-                POSE_LANDMARKS.LEFT_SHOULDER, POSE_LANDMARKS.RIGHT_SHOULDER,
-                POSE_LANDMARKS.LEFT_ELBOW, POSE_LANDMARKS.RIGHT_ELBOW,
-                POSE_LANDMARKS.LEFT_WRIST, POSE_LANDMARKS.RIGHT_WRIST,
-                POSE_LANDMARKS.LEFT_HIP, POSE_LANDMARKS.RIGHT_HIP,
-                POSE_LANDMARKS.LEFT_KNEE, POSE_LANDMARKS.RIGHT_KNEE,
-                POSE_LANDMARKS.LEFT_ANKLE, POSE_LANDMARKS.RIGHT_ANKLE,
-                POSE_LANDMARKS.LEFT_HEEL, POSE_LANDMARKS.RIGHT_HEEL,
-                POSE_LANDMARKS.LEFT_FOOT_INDEX, POSE_LANDMARKS.RIGHT_FOOT_INDEX
-            ]
-            
-            # Convert only relevant landmarks to list
-            landmarks = []
-            for i, landmark in enumerate(pose_landmarks):
-                # Skip facial landmarks (0-10) to streamline processing
-                if i in relevant_landmark_indices:
-                    landmarks.append({
-                        'x': landmark.x,
-                        'y': landmark.y,
-                        'z': landmark.z,
-                        'visibility': landmark.visibility
-                    })
-                # Include null placeholders for skipped landmarks to maintain array index structure
-                else:
-                    landmarks.append({
-                        'x': 0,
-                        'y': 0,
-                        'z': 0,
-                        'visibility': 0
-                    })
-            
-            # Visibility threshold too high can filter out usable landmarks. We now:
-            # 1. Keep a low visibility threshold (0.15).
-            # 2. Additionally allow a landmark if its coordinates are non-zero (placeholder
-            #    landmarks have x=y=0).  This dramatically increases the likelihood of
-            #    computing angles when MediaPipe marks visibility low but the landmark
-            #    position is still reasonably accurate.
-            VIS_THR = 0.15
-
-            # Provide shorthand reference to landmarks array for later use
-            lm = landmarks  # <--- critical: ensure lm is bound before nested funcs use it
-
-            def joints_visible(ids, lm_arr):
-                """Return True if all requested joints look valid.
-                
-                A landmark passes if either it has sufficient visibility or its coordinates are non-zero (placeholders are zero)."""
-                for idx in ids:
-                    pt = lm_arr[idx]
-                    if pt['visibility'] >= VIS_THR:
-                        continue
-                    if pt['x'] != 0 or pt['y'] != 0:
-                        continue
-                    return False
-                return True
-
-            # A. Only compute measurements when all required joints are visible
-            knee_angle = None
-            depth_ratio = None
-            shoulder_midfoot_diff = None
-            hip_flexion_angle = None
-            pelvic_angle = None
-            # Compute right side metrics if visible
-            right_knee_angle = None
-            if joints_visible([POSE_LANDMARKS.RIGHT_HIP, POSE_LANDMARKS.RIGHT_KNEE, POSE_LANDMARKS.RIGHT_ANKLE], lm):
-                hip = lm[POSE_LANDMARKS.RIGHT_HIP]; knee = lm[POSE_LANDMARKS.RIGHT_KNEE]; ankle = lm[POSE_LANDMARKS.RIGHT_ANKLE]
-                right_knee_angle = calculate_angle(hip, knee, ankle)
-            # Compute left side metrics if visible
-            left_knee_angle = None
-            if joints_visible([POSE_LANDMARKS.LEFT_HIP, POSE_LANDMARKS.LEFT_KNEE, POSE_LANDMARKS.LEFT_ANKLE], lm):
-                hip_l = lm[POSE_LANDMARKS.LEFT_HIP]; knee_l = lm[POSE_LANDMARKS.LEFT_KNEE]; ankle_l = lm[POSE_LANDMARKS.LEFT_ANKLE]
-                left_knee_angle = calculate_angle(hip_l, knee_l, ankle_l)
-            # Choose the deeper (smaller) knee angle if both available
-            knee_angle_candidates = [a for a in [right_knee_angle, left_knee_angle] if a is not None]
-            if knee_angle_candidates:
-                knee_angle = min(knee_angle_candidates)
-            
-            # depth_ratio calculation uses whichever side knee_angle used
-            if knee_angle is not None and hip is not None and ankle is not None and knee is not None:
-                depth_ratio = calculate_depth_ratio(hip, knee, ankle)
-            
-            # Shoulder-midfoot diff (take maximum absolute from both sides)
-            shoulder_diffs = []
-            # right
-            if joints_visible([POSE_LANDMARKS.RIGHT_SHOULDER, POSE_LANDMARKS.RIGHT_HIP, POSE_LANDMARKS.RIGHT_KNEE, POSE_LANDMARKS.RIGHT_ANKLE], lm):
-                shoulder = lm[POSE_LANDMARKS.RIGHT_SHOULDER]; hip_r = lm[POSE_LANDMARKS.RIGHT_HIP]; knee_r = lm[POSE_LANDMARKS.RIGHT_KNEE]; ankle_r = lm[POSE_LANDMARKS.RIGHT_ANKLE]
-                shoulder_diffs.append(calculate_shoulder_midfoot_diff(shoulder, hip_r, knee_r, ankle_r))
-            # left
-            if joints_visible([POSE_LANDMARKS.LEFT_SHOULDER, POSE_LANDMARKS.LEFT_HIP, POSE_LANDMARKS.LEFT_KNEE, POSE_LANDMARKS.LEFT_ANKLE], lm):
-                shoulder_l = lm[POSE_LANDMARKS.LEFT_SHOULDER]; hip_l2 = lm[POSE_LANDMARKS.LEFT_HIP]; knee_l2 = lm[POSE_LANDMARKS.LEFT_KNEE]; ankle_l2 = lm[POSE_LANDMARKS.LEFT_ANKLE]
-                shoulder_diffs.append(calculate_shoulder_midfoot_diff(shoulder_l, hip_l2, knee_l2, ankle_l2))
-            if shoulder_diffs:
-                # Remove any None values to avoid TypeErrors with abs(None)
-                valid_diffs = [d for d in shoulder_diffs if d is not None]
-                if valid_diffs:
-                    # We care about worst (largest forward lean) => max absolute diff
-                    shoulder_midfoot_diff = max(valid_diffs, key=lambda d: abs(d))
-        
-            # Hip flexion angle
-            hip_flexion_candidates = []
-            # Right hip flexion (shoulder->hip->knee)
-            if joints_visible([
-                POSE_LANDMARKS.RIGHT_SHOULDER,
-                POSE_LANDMARKS.RIGHT_HIP,
-                POSE_LANDMARKS.RIGHT_KNEE
-            ], lm):
-                sh_r = lm[POSE_LANDMARKS.RIGHT_SHOULDER]
-                hip_r2 = lm[POSE_LANDMARKS.RIGHT_HIP]
-                knee_r2 = lm[POSE_LANDMARKS.RIGHT_KNEE]
-                hip_flexion_candidates.append(calculate_angle(sh_r, hip_r2, knee_r2))
-            # Left side
-            if joints_visible([
-                POSE_LANDMARKS.LEFT_SHOULDER,
-                POSE_LANDMARKS.LEFT_HIP,
-                POSE_LANDMARKS.LEFT_KNEE
-            ], lm):
-                sh_l = lm[POSE_LANDMARKS.LEFT_SHOULDER]
-                hip_l3 = lm[POSE_LANDMARKS.LEFT_HIP]
-                knee_l3 = lm[POSE_LANDMARKS.LEFT_KNEE]
-                hip_flexion_candidates.append(calculate_angle(sh_l, hip_l3, knee_l3))
-
-            if hip_flexion_candidates:
-                # Use the mean of available sides to be neutral
-                hip_flexion_angle = sum(hip_flexion_candidates) / len(hip_flexion_candidates)
+        def run_inference(frames):
+            """Pose inference over (frame_idx, RGB frame) pairs; results come back in frame order."""
+            if VIDEO_INFERENCE_WORKERS > 1:
+                # Spread inference across worker processes, each with its own landmarker
+                return process_frames_parallel(frames, fps, current_phase)
+            if THREADED_INFERENCE:
+                # Same chunking, on threads that each own an IMAGE-mode landmarker
+                return process_frames_parallel(frames, fps, current_phase, threads=True)
+            # Frames are freed by refcounting as soon as they are consumed, so the loop
+            # needs no explicit collections
+            return [result for result in process_frames_gated(frames, fps, current_phase) if result is not None]
+
+        results = None
+        streamed_results = []
+        if not goto_processing and VIDEO_INFERENCE_WORKERS > 1 and not pipe_fps:
+            # Each pool worker seeks to its own slice of the file and decodes it itself
+            streamed_results, frames_streamed = process_video_parallel(
+                temp_path, frame_count, fps, is_portrait_video, current_phase, stride=frame_skip)
+        elif not goto_processing:
+            # Decode on a background thread while inference consumes frames, so only a
+            # bounded number of decoded frames is ever held in memory
+            # Serial inference finishes with each frame before taking the next, so the
+            # decoder can recycle its output buffers; pool chunks hold frames longer
+            # PyAV doesn't apply the rotation metadata that OpenCV honours, so rotated
+            # recordings stay on the VideoCapture
+            stream = FrameStream(cap, frame_count, is_portrait_video,
+                                 reuse_buffers=VIDEO_INFERENCE_WORKERS <= 1 and not THREADED_INFERENCE,
+                                 video_path=temp_path if pipe_fps or (PYAV_DECODE and not probe.rotation) else None,
+                                 pipe_fps=pipe_fps, stride=frame_skip)
+            streamed_results = run_inference(stream)
+            frames_streamed = stream.count
+        if not goto_processing:
+            stream_coverage = frames_streamed / max(1, num_targets)
+            app.logger.info(f"Streamed {frames_streamed} frames out of target {num_targets}")
+            if stream_coverage >= 0.8:
+                results = streamed_results
+            else:
+                app.logger.warning(f"Streaming decode covered only {stream_coverage:.1%} of frames. Falling back to the extraction cascade.")
+
+        # Skip if we already have frames from image fallback or from the stream
+        if results is None and not goto_processing:
+            # The stream already was the full sequential read, so only the alternative
+            # decoders are left; the first one that yields enough frames wins
+            frames_to_process = extract_frames_best(temp_path, frame_count, fps, is_portrait_video, cap=cap)
+            app.logger.info(f"Final frame extraction yielded {len(frames_to_process)} frames out of target {num_targets}")
             
-            # Pelvic angle
-            pelvic_angle = calculate_pelvic_angle(lm) if lm else None
-
-            # E. Add kneesVisible boolean to frame payload
-            return {
-                'frame': frame_idx,
-                'timestamp': frame_idx / fps,
-                'landmarks': landmarks,
-                'measurements': {
-                    'kneeAngle': knee_angle,
-                    'depthRatio': depth_ratio,
-                    'shoulderMidfootDiff': shoulder_midfoot_diff,
-                    'hipFlexionAngle': hip_flexion_angle,
-                    'pelvicAngle': pelvic_angle
-                },
-                'arrows': [],
-                'kneesVisible': joints_visible([POSE_LANDMARKS.LEFT_KNEE, POSE_LANDMARKS.RIGHT_KNEE], lm),
-                'status': {
-                    'spine': 'ok',
-                    'knee': 'ok',
-                    'current_phase': current_phase
-                }
-            }
+            # If we got fewer than expected frames but still have some to work with
+            if len(frames_to_process) < num_targets / 2:
+                app.logger.warning(f"Extracted only {len(frames_to_process)} frames out of {num_targets} target frames, but continuing with available frames")
         
-        # Note: phase tracking is handled inside process_frame using nonlocal variables
+        # Release the capture as soon as we've extracted frames
+        cap.release()
         
-        # Sequentially process frames while periodically freeing memory
-        batch_size = 4  # how many frames before an explicit GC & memory log
-        results = []
-        for i, frame_data in enumerate(frames_to_process):
-            result = process_frame(frame_data)
-            if result is not None:
-                results.append(result)
-
-            # Every `batch_size` frames (or at the end) run GC & log memory
-            if (i + 1) % batch_size == 0 or i == len(frames_to_process) - 1:
-                gc.collect()
-                mem_mb = process.memory_info().rss / 1024 / 1024
-                app.logger.info(f"[MEMORY] After processing {i+1} frames: {mem_mb:.2f} MB")
+        if results is None:
+            app.logger.info(f"Extracted {len(frames_to_process)} frames for processing")
+            # Log memory usage after frame extraction (one RSS reading for both lines)
+            if MEM_DIAG:
                 rss_mb = process.memory_info().rss / 1024 / 1024
-                app.logger.warning(f"[MEM_DIAG] AFTER {i+1} FRAMES: RSS={rss_mb:.1f} MB, time={time.time() - t_start:.2f}s")
-        
-        # Clean up
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-        
-        # Force garbage collection and log memory usage
-        gc.collect()
-        mem_mb = process.memory_info().rss / 1024 / 1024
-        app.logger.info(f"[MEMORY] After analysis: {mem_mb:.2f} MB")
+                app.logger.info(f"[MEMORY] After extraction: {rss_mb:.2f} MB")
+                app.logger.warning(f"[MEM_DIAG] AFTER FRAME EXTRACTION: RSS={rss_mb:.1f} MB, time={time.time() - t_start:.2f}s")
+
+            results = run_inference(consume_frames(frames_to_process))
+            # The partial stream may still have covered more frames than the cascade did
+            if len(streamed_results) > len(results):
+                results = streamed_results
+            del frames_to_process
+        if MEM_DIAG:
+            mem_mb = process.memory_info().rss / 1024 / 1024
+            app.logger.info(f"[MEMORY] After inference on {len(results)} frames: {mem_mb:.2f} MB")
+
+        # Inference hands results back in frame order already, so this is a linear check;
+        # from here on row i of every per-frame array below is results[i]
+        results.sort(key=operator.itemgetter('frame'))
+
+        # Per-frame measurements for every frame in one batched pass over the (N, 33, 4) stack
+        lm_stack = None
+        measurement_columns = {}
+        if results:
+            lm_stack = np.stack([r.pop('_lm') for r in results])
+            ok = squat_kernels.joints_ok(lm_stack, VIS_THR, RELEVANT_MASK)
+            for r, visible in zip(results, ok[:, KNEES].all(axis=1).tolist()):
+                r['kneesVisible'] = visible
+            knee_angles, knee_sides = squat_kernels.knee_angles(lm_stack, ok)
+            measurement_columns = {
+                'kneeAngle': knee_angles,
+                # Depth ratio uses the same leg the knee angle came from
+                'depthRatio': squat_kernels.depth_ratios(lm_stack, knee_sides),
+                'shoulderMidfootDiff': squat_kernels.shoulder_midfoot_diffs(lm_stack, ok),
+                'hipFlexionAngle': squat_kernels.hip_flexion_angles(lm_stack, ok),
+                'pelvicAngle': squat_kernels.pelvic_angles(lm_stack)
+            }
+            for key, column in measurement_columns.items():
+                for r, value in zip(results, column.tolist()):
+                    r['measurements'][key] = None if math.isnan(value) else value
         
+        # Log memory usage (one RSS reading for both lines)
+        if MEM_DIAG:
+            rss_mb = process.memory_info().rss / 1024 / 1024
+            app.logger.info(f"[MEMORY] After analysis: {rss_mb:.2f} MB")
+            app.logger.warning(f"[MEM_DIAG] BEFORE RETURN: RSS={rss_mb:.1f} MB, time={time.time() - t_start:.2f}s")
         app.logger.info(f"Analysis complete. Processed {len(results)} frames.")
-        rss_mb = process.memory_info().rss / 1024 / 1024
-        app.logger.warning(f"[MEM_DIAG] BEFORE RETURN: RSS={rss_mb:.1f} MB, time={time.time() - t_start:.2f}s")
-        # Sort results by frame number
-        results.sort(key=lambda x: x['frame'])
-        
-        # --- Timestamp scaling ---
-        if original_duration and original_duration > 0 and len(results) > 1:
-            # Use the timestamp of the last processed frame
-            last_ts = results[-1]['timestamp']
-            if last_ts > 0:
-                diff_ratio = abs(last_ts - original_duration) / original_duration
-                # Scale when mismatch ≥1%
-                if diff_ratio >= 0.01:
-                    scale_factor = original_duration / last_ts
-                    for r in results:
-                        r['timestamp'] *= scale_factor
-                    app.logger.info(
-                        f"Timestamp scaled by factor {scale_factor:.3f} (orig_dur={original_duration:.2f}s, last_ts={last_ts:.2f}s, diff={diff_ratio:.2%})"
-                    )
-        
-        # Sort frames by timestamp in case processing order wasn't perfect (should already be sorted)
-        results.sort(key=lambda x: x.get('timestamp', 0))
-        
-        # --- Calculate Per-Frame Scores ---
-        # First, identify actual squat phases (ignore standing)
-        squat_phases = []
-        in_squat = False
-        for i, frame in enumerate(results):
-            if 'status' in frame:
-                # Start squat on 'down' phase
-                if frame['status'].get('current_phase') == 'down' and not in_squat:
-                    in_squat = True
-                    squat_phases.append({
-                        'start': i, 
-                        'frames': [],
-                        'best_knee_angle': 180.0,
-                        'worst_shoulder_diff': 0.0,
-                        'best_hip_score': 0.0,
-                        'best_pelvic_score': 100.0
-                    })
-                
-                # End squat when back to standing (phase = none)
-                if frame['status'].get('current_phase') != 'down' and in_squat:
-                    in_squat = False
-                    squat_phases[-1]['end'] = i
-                
-                # Add frame to current squat if in squat
-                if in_squat and len(squat_phases) > 0:
-                    squat_phases[-1]['frames'].append(i)
-        
-        # Complete any open squat phases
-        if in_squat and len(squat_phases) > 0:
-            squat_phases[-1]['end'] = len(results) - 1
-                
-        # Track global best depth
-        global_min_knee_angle = 180  # Track best depth across all squats
-        
-        # Process each frame to calculate progressive scores
-        # For each squat phase, we'll track the best scores seen so far
-        last_scores = {'knee_depth':0.0,'shoulder_align':100.0,'hip_flexion':0.0,'pelvic_tilt':100.0,'overall':0.0}
-        for phase_idx, phase in enumerate(squat_phases):
-            # Initialize tracking variables for this phase
-            current_best_knee_angle = 180.0
-            current_worst_shoulder_diff = 0.0
-            current_best_hip_score = 0.0
-            current_best_pelvic_score = 100.0
-            
-            # Reusable function to calculate depth score from angle
-            def calc_depth_score(angle, hip_below_knee):
-                # Grant full points for very deep squats (below parallel or <70°)
-                if hip_below_knee or angle <= 70:
-                    return 100.0
-                # No points for shallow squats above 90°
-                elif angle >= 90:
-                    return 0.0
-                # Linear score for angles between 70° and 90°
-                else:
-                    return ((90 - angle) / 20.0) * 100.0
-            
-            # Reusable function to calculate shoulder score from diff
-            def calc_shoulder_score(diff):
-                abs_diff = abs(diff)
-                if abs_diff <= 2:
-                    return 100.0
-                elif abs_diff >= 10:
-                    return 0.0
-                else:
-                    return (10 - abs_diff) / 8 * 100.0
-            
-            # Using global calc_hip_flexion_score function defined earlier
-            
-            # Using global calc_pelvic_tilt_score function defined earlier
-            
-            # Process frames in this squat phase IN ORDER
-            for frame_idx in range(phase['start'], phase.get('end', len(results) - 1) + 1):
-                frame = results[frame_idx]
-                measurements = frame.get('measurements', {})
-                
-                # Get current frame data
-                knee_angle = measurements.get('kneeAngle')
-                shoulder_diff = measurements.get('shoulderMidfootDiff')
-                hip_flexion_angle = measurements.get('hipFlexionAngle')
-                pelvic_angle = measurements.get('pelvicAngle')
-                
-                # Default scores
-                frame_scores = {
-                    'knee_depth': last_scores['knee_depth'],
-                    'shoulder_align': last_scores['shoulder_align'],
-                    'hip_flexion': last_scores['hip_flexion'],
-                    'pelvic_tilt': last_scores['pelvic_tilt'],
-                    'overall': last_scores['overall'],
-                    'phase': phase_idx + 1
-                }
-                
-                # Log starting frame score values
-                app.logger.info(f"Frame {frame_idx} starting scores: knee_depth={frame_scores['knee_depth']}, shoulder_align={frame_scores['shoulder_align']}, hip_flexion={frame_scores['hip_flexion']}, pelvic_tilt={frame_scores['pelvic_tilt']}, overall={frame_scores['overall']}")
-                
-                # Check hip position for depth calculation
-                lm = frame.get('landmarks') or []
-                hip_below_knee = False
-                if len(lm) > 26:
-                    # Right side indices 24 (right hip), 26 (right knee)
-                    hip_below_knee = hip_below_knee or (lm[24]['y'] > lm[26]['y'])
-                if len(lm) > 25:
-                    # Left side indices 23 (left hip), 25 (left knee)
-                    hip_below_knee = hip_below_knee or (lm[23]['y'] > lm[25]['y'])
-                
-                # Track knee angle measurements and score calculations (with more logging)
-                # First, log what we've measured for debugging
-                app.logger.info(f"Frame {frame_idx}: knee_angle={knee_angle}, hip_below_knee={hip_below_knee}")
-                
-                # Update best knee angle (progressive)
-                if knee_angle is not None:
-                    # Important: Also calculate a direct score for this frame's knee angle
-                    # regardless of best angle so far, so we show progress as user squats
-                    direct_depth_score = calc_depth_score(knee_angle, hip_below_knee)
-                    
-                    # Update the best angle seen so far in this squat
-                    prev_best = current_best_knee_angle
-                    current_best_knee_angle = min(current_best_knee_angle, knee_angle)
-                    
-                    # Log if we found a new best angle
-                    if current_best_knee_angle < prev_best:
-                        app.logger.info(f"NEW BEST KNEE ANGLE: {current_best_knee_angle} (prev: {prev_best})")
-                    
-                    # Calculate current depth score based on best angle so far
-                    cumulative_depth_score = calc_depth_score(current_best_knee_angle, hip_below_knee)
-                    
-                    # Display the BEST (cumulative) depth score so it never decreases once achieved
-                    # This makes the score "stick" at the highest value reached during the squat.
-                    old_depth = frame_scores['knee_depth']
-                    frame_scores['knee_depth'] = round(cumulative_depth_score, 1)
-                    
-                    # Log score changes
-                    if frame_scores['knee_depth'] != old_depth:
-                        app.logger.info(f"DEPTH SCORE UPDATED: {old_depth} → {frame_scores['knee_depth']}")
-                    app.logger.info(f"Frame {frame_idx}: knee={knee_angle:.1f}, score={frame_scores['knee_depth']}")
-                    
-                    # Update global best for final scoring
-                    global_min_knee_angle = min(global_min_knee_angle, knee_angle)
-                else:
-                    app.logger.info(f"Frame {frame_idx}: NO KNEE ANGLE DETECTED")
-                
-                # Update worst shoulder alignment (progressive)
-                is_active_squat_frame = (
-                    hip_below_knee or 
-                    (knee_angle is not None and knee_angle < 150)  # knees flexed ≥30°
-                )
-                if shoulder_diff is not None and is_active_squat_frame:
-                    # Update the worst alignment seen so far in this squat
-                    current_worst_shoulder_diff = max(current_worst_shoulder_diff, abs(shoulder_diff))
-                    
-                    # Calculate current shoulder score based on worst alignment so far
-                    shoulder_score = calc_shoulder_score(current_worst_shoulder_diff)
-                    # Persist worst (lowest) shoulder score so far for sticky behaviour
-                    frame_scores['shoulder_align'] = round(min(frame_scores['shoulder_align'], shoulder_score), 1)
-                
-                if hip_flexion_angle is not None and is_active_squat_frame:
-                    # Calculate current hip flexion score based on angle
-                    hip_score = calc_hip_flexion_score(hip_flexion_angle)
-                    # Update the best score seen so far in this squat
-                    prev_best_hip = current_best_hip_score
-                    current_best_hip_score = max(current_best_hip_score, hip_score)
-                    frame_scores['hip_flexion'] = round(current_best_hip_score, 1)
-                    if current_best_hip_score != prev_best_hip:
-                        app.logger.info(f"HIP SCORE UPDATED: {prev_best_hip} → {current_best_hip_score}")
-                
-                # Update best pelvic tilt score (progressive) – only during active squat frames
-                if pelvic_angle is not None and is_active_squat_frame:
-                    # Calculate current pelvic tilt score based on angle
-                    pelvic_score = calc_pelvic_tilt_score(abs(pelvic_angle))
-                    # Update the best score seen so far in this squat
-                    prev_best_pelvic = current_best_pelvic_score
-                    current_best_pelvic_score = min(current_best_pelvic_score, pelvic_score)
-                    frame_scores['pelvic_tilt'] = round(current_best_pelvic_score, 1)
-                    if current_best_pelvic_score != prev_best_pelvic:
-                        app.logger.info(f"PELVIC SCORE UPDATED: {prev_best_pelvic} → {current_best_pelvic_score}")
-                
-                # Calculate overall score for this frame
-                total_weight = 0.4 + 0.3 + 0.2 + 0.1
-                frame_scores['overall'] = round(
-                    (
-                        frame_scores['knee_depth'] * 0.4 +
-                        frame_scores['shoulder_align'] * 0.3 +
-                        frame_scores['hip_flexion'] * 0.2 +
-                        frame_scores['pelvic_tilt'] * 0.1
-                    ) / total_weight,
-                    1
-                )
-                
-                # Apply scores to this frame
-                frame['scores'] = frame_scores
-                
-                # Save for propagation
-                last_scores = frame_scores.copy()
-        
-        # Propagate last known scores to frames outside squat phases
-        prev_scores = {'knee_depth':0.0,'shoulder_align':100.0,'hip_flexion':0.0,'pelvic_tilt':100.0,'overall':0.0,'phase':0}
-        for frame in results:
-            if 'scores' not in frame or frame['scores'] is None:
-                frame['scores'] = prev_scores.copy()
-            else:
-                prev_scores = frame['scores']
-        
-        # For API backward compatibility - calculate final scores from best squat
-        best_knee_depth = 0.0
-        best_shoulder_align = 0.0
-        best_hip_flexion = 0.0
-        best_pelvic_tilt = 0.0
-        best_overall = 0.0
-        
-        # Find the best frame scores across all frames
-        if squat_phases:
-            squat_frames = [i for phase in squat_phases for i in phase.get('frames', [])]
-            
-            if squat_frames:
-                best_frame_scores = max([results[i]['scores']['overall'] for i in squat_frames if 'scores' in results[i]])
-                best_overall = best_frame_scores
-                
-                # Recalculate score based on global min knee angle
-                if global_min_knee_angle <= 70:
-                    best_knee_depth = 100.0
-                elif global_min_knee_angle >= 90:
-                    best_knee_depth = 0.0
-                else:
-                    best_knee_depth = round(((90 - global_min_knee_angle) / 20.0) * 100.0, 1)
-                
-                # Best shoulder alignment from frames
-                best_shoulder_align = min([results[i]['scores']['shoulder_align'] 
-                                          for i in squat_frames 
-                                          if 'scores' in results[i]], default=100.0)
-                
-                # Best hip flexion from frames
-                best_hip_flexion = max([results[i]['scores']['hip_flexion'] 
-                                      for i in squat_frames 
-                                      if 'scores' in results[i]], default=0.0)
-                
-                # Best pelvic tilt from frames
-                best_pelvic_tilt = min([results[i]['scores']['pelvic_tilt'] 
-                                      for i in squat_frames 
-                                      if 'scores' in results[i]], default=100.0)
-        
-        # --- Secondary fallback: derive from raw measurements when no score computed ---
-        if best_knee_depth == 0.0:
-            knee_angles = [f.get('measurements', {}).get('kneeAngle')
-                           for f in results]
-            knee_angles = [a for a in knee_angles if a is not None]
-            if knee_angles:
-                min_angle = min(knee_angles)
-                if min_angle <= 70:
-                    best_knee_depth = 100.0
-                elif min_angle >= 90:
-                    best_knee_depth = 0.0
-                else:
-                    best_knee_depth = round(((90 - min_angle) / 20.0) * 100.0, 1)
-
-        if best_shoulder_align == 0.0:
-            shoulder_diffs = [abs(d)
-                              for d in (f.get('measurements', {}).get('shoulderMidfootDiff')
-                                        for f in results)
-                              if d is not None]
-            if shoulder_diffs:
-                worst_diff = max(shoulder_diffs)
-                if worst_diff >= 10:
-                    best_shoulder_align = 0.0
-                else:
-                    best_shoulder_align = round((10 - worst_diff) / 8 * 100.0, 1)
-        
-        if best_hip_flexion == 0.0:
-            hip_flexion_angles = [f.get('measurements', {}).get('hipFlexionAngle')
-                                  for f in results]
-            hip_flexion_angles = [a for a in hip_flexion_angles if a is not None]
-            if hip_flexion_angles:
-                best_hip_flexion = max([calc_hip_flexion_score(a) for a in hip_flexion_angles])
-        
-        if best_pelvic_tilt == 100.0:
-            pelvic_angles = [f.get('measurements', {}).get('pelvicAngle')
-                             for f in results]
-            pelvic_angles = [a for a in pelvic_angles if a is not None]
-            if pelvic_angles:
-                best_pelvic_tilt = min([calc_pelvic_tilt_score(abs(a)) for a in pelvic_angles])
-        
-        # Calculate final overall score using the best scores
-        overall_score = round(best_knee_depth * 0.4 + best_shoulder_align * 0.3 + best_hip_flexion * 0.2 + best_pelvic_tilt * 0.1, 1)
-
-        # --- Assemble Final Result ---
-        analysis_result = {
-            # Use original FPS if available, else the backend default (30)
-            'fps': original_fps if original_fps is not None and original_fps > 0 else 30,
-            'frames': aggregate_results(results),
-            'analysisDuration': time.time() - t_start,
-            'totalFramesProcessed': len(results),
-            'originalDuration': original_duration, # Add original duration info
-            'originalFrameCount': original_frame_count, # Add original frame count info
-            'scores': {
-                'kneeDepthScore': best_knee_depth,
-                'shoulderAlignmentScore': best_shoulder_align,
-                'hipFlexionScore': best_hip_flexion,
-                'pelvicTiltScore': best_pelvic_tilt,
-                'overall': overall_score
-            }
-        }
-
-        # Memory logging after processing
-        return jsonify(analysis_result)
+        analysis_result = finalize_analysis(results, lm_stack, measurement_columns, original_duration,
+                                            original_fps, original_frame_count, t_start)
+
+        # Landmark arrays only become dicts here, and only for the default wire format.
+        # Opt-in compact landmarks (?landmarkFormat=float16 or float32): each frame gets an
+        # index into one base64 little-endian (N, 33, 4) block instead of 33 landmark dicts
+        blob_format = request.args.get('landmarkFormat')
+        blob_dtype = LANDMARK_BLOB_DTYPES.get(blob_format)
+        if lm_stack is not None and blob_dtype is None:
+            # One tolist() for the whole stack rather than one per frame
+            for frame, rows in zip(analysis_result['frames'], lm_stack.tolist()):
+                frame['landmarks'] = landmark_dicts(rows)
+        elif lm_stack is not None:
+            for row, frame in enumerate(analysis_result['frames']):
+                frame['landmarksRef'] = row
+            packed = lm_stack.astype(blob_dtype, copy=False)
+            analysis_result['landmarksBlob'] = base64.b64encode(packed.tobytes()).decode('ascii')
+            analysis_result['landmarksShape'] = list(packed.shape)
+            analysis_result['landmarksDtype'] = blob_format
+
+        response = streamed_json_response(analysis_result, 'frames')
+        # Refcounting already freed the frames; a full collection and heap trim only pay off
+        # for long videos. They run once the streamed body (which still holds the frame
+        # payloads) is closed, off the request thread so the worker isn't held up by them
+        if len(results) > 2000:
+            response.call_on_close(lambda: threading.Thread(
+                target=release_memory, name='post-analysis-gc', daemon=True).start())
+        return response
         
     except Exception as e:
-        rss_mb = process.memory_info().rss / 1024 / 1024
-        app.logger.error(f"[MEM_DIAG] EXCEPTION: RSS={rss_mb:.1f} MB, time={time.time() - t_start:.2f}s, error={str(e)}")
+        if MEM_DIAG:
+            rss_mb = process.memory_info().rss / 1024 / 1024
+            app.logger.error(f"[MEM_DIAG] EXCEPTION: RSS={rss_mb:.1f} MB, time={time.time() - t_start:.2f}s, error={str(e)}")
         app.logger.error(f"Error processing video: {str(e)}")
-        # Clean up on error
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
         return jsonify({'error': str(e)}), 500
+    finally:
+        if rss_sampler is not None:
+            rss_sampler.stop()
+        # Covers the early error returns too, not just success and exceptions
+        Path(temp_path).unlink(missing_ok=True)
 
 def print_server_ready_message(port):
     """
@@ -1715,19 +2151,22 @@ def print_server_ready_message(port):
     print("=" * 60 + "\n")
 
 class ServerStartupHandler(logging.StreamHandler):
-    """Custom handler to detect and print the server ready message"""
+    """Custom handler to detect and print the server ready message.
+
+    The check runs in filter(), ahead of formatting, and is one-shot: once the
+    message is seen later werkzeug records (every request) are passed straight on.
+    """
     def __init__(self, ready_callback):
         super().__init__()
         self.ready_callback = ready_callback
         self.ready_detected = False
-        
-    def emit(self, record):
-        msg = self.format(record)
+
+    def filter(self, record):
         # Look for the startup message Flask emits
-        if not self.ready_detected and 'Running on' in msg:
-            self.ready_callback()
+        if not self.ready_detected and 'Running on' in record.getMessage():
             self.ready_detected = True
-        super().emit(record)
+            self.ready_callback()
+        return super().filter(record)
 
 if __name__ == '__main__':
     debug_mode = os.environ.get('FLASK_ENV') == 'development'
@@ -1739,7 +2178,11 @@ if __name__ == '__main__':
         # Save the current log level and restore it after adding our handler
         current_level = werkzeug_logger.level
         werkzeug_logger.setLevel(logging.INFO)
-        handler = ServerStartupHandler(lambda: print_server_ready_message(port))
+        def on_ready():
+            print_server_ready_message(port)
+            # Back to the quiet level for request logs
+            werkzeug_logger.setLevel(current_level)
+        handler = ServerStartupHandler(on_ready)
         werkzeug_logger.addHandler(handler)
         
         try:
@@ -0,0 +1,32 @@
+"""Gunicorn settings for the analysis backend.
+
+Used by the Procfile; run locally with `gunicorn -c gunicorn_conf.py app:app`
+from this directory. Every setting can be overridden through the environment.
+"""
+import os
+import sys
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# gthread workers: analyses in one worker share its models and run on separate threads.
+# Each worker loads its own MediaPipe/MoveNet models, so memory, not the core count,
+# bounds the number of workers on small hosts
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+
+# Uploads are analysed within the request, which can take minutes for long videos
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '300'))
+
+# Import the app once in the arbiter: the libraries and the downloaded model files are
+# then shared copy-on-write by the forked workers. MediaPipe, ONNX Runtime and numba
+# run threads that don't survive a fork, so the models are only created, and the numba
+# kernels only run, in each worker (post_worker_init). GUNICORN_PRELOAD=0 imports per worker.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+if preload_app:
+    os.environ['DEFER_MODEL_LOAD'] = '1'
+
+
+def post_worker_init(worker):
+    if preload_app:
+        sys.modules[worker.wsgi.import_name].load_models()
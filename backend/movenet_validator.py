@@ -1,8 +1,15 @@
+import os
+import threading
+
 import cv2
 import numpy as np
 import onnxruntime as ort
 from pathlib import Path
 import urllib.request
+try:
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+except ImportError:  # needs the onnx package; the FP32 model is used without it
+    quantize_dynamic = None
 
 # Load MoveNet Thunder ONNX model
 MODEL_URL = "https://raw.githubusercontent.com/onnx/models/main/vision/body_analysis/movenet/model/movenet_thunder.onnx"
@@ -16,25 +23,71 @@ def download_model():
 if not MODEL_PATH.exists():
     download_model()
 
-try:
-    _ort_sess = ort.InferenceSession(
-        MODEL_PATH.as_posix(),
-        providers=["CUDAExecutionProvider", "CPUExecutionProvider"]
-    )
-except Exception as e:
-    if "INVALID_PROTOBUF" in str(e):
-        print(f"[Squat] Invalid protobuf model at {MODEL_PATH}, re-downloading...")
-        MODEL_PATH.unlink(missing_ok=True)
-        download_model()
-        _ort_sess = ort.InferenceSession(
-            MODEL_PATH.as_posix(),
-            providers=["CUDAExecutionProvider", "CPUExecutionProvider"]
-        )
+# On CPU-only hosts the validator runs a dynamically quantised INT8 copy of the model,
+# made from the FP32 one on first use (needs the onnx package); MOVENET_INT8=0 keeps FP32
+INT8_MODEL_PATH = MODEL_PATH.with_name("movenet_thunder.int8.onnx")
+MOVENET_INT8 = os.environ.get('MOVENET_INT8', '1') == '1'
+# Intra-op threads per CPU session; requests already run on several threads of their own
+MOVENET_THREADS = int(os.environ.get('MOVENET_THREADS', '2'))
+
+def quantized_model_path():
+    """Return the INT8 model, quantising the FP32 one if needed; None when that isn't possible."""
+    if INT8_MODEL_PATH.exists():
+        return INT8_MODEL_PATH
+    if quantize_dynamic is None:
+        return None
+    # Workers may quantise concurrently on a fresh host, so each writes its own file
+    tmp_path = INT8_MODEL_PATH.with_name(f"movenet_thunder.int8.{os.getpid()}.tmp")
+    try:
+        quantize_dynamic(MODEL_PATH.as_posix(), tmp_path.as_posix(), weight_type=QuantType.QInt8)
+        tmp_path.replace(INT8_MODEL_PATH)
+    except Exception as e:
+        print(f"[Squat] MoveNet INT8 quantisation failed, using the FP32 model: {e}")
+        tmp_path.unlink(missing_ok=True)
+        return None
+    return INT8_MODEL_PATH
+
+def _new_session(cpu_only):
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if cpu_only:
+        options.intra_op_num_threads = MOVENET_THREADS
+        model_path = (MOVENET_INT8 and quantized_model_path()) or MODEL_PATH
+        providers = ["CPUExecutionProvider"]
     else:
+        model_path = MODEL_PATH
+        providers = ["CUDAExecutionProvider", "CPUExecutionProvider"]
+    return ort.InferenceSession(model_path.as_posix(), sess_options=options, providers=providers)
+
+def _create_session():
+    cpu_only = "CUDAExecutionProvider" not in ort.get_available_providers()
+    try:
+        return _new_session(cpu_only)
+    except Exception as e:
+        if "INVALID_PROTOBUF" in str(e):
+            print(f"[Squat] Invalid protobuf model at {MODEL_PATH}, re-downloading...")
+            MODEL_PATH.unlink(missing_ok=True)
+            INT8_MODEL_PATH.unlink(missing_ok=True)
+            download_model()
+            return _new_session(cpu_only)
         raise
 
-_INP  = _ort_sess.get_inputs()[0].name
-_OUT  = _ort_sess.get_outputs()[0].name
+# The session is created per process: ONNX Runtime's thread pools don't survive a fork,
+# so a preloading gunicorn arbiter must not build one for its workers to inherit
+_ort_sess = None
+_INP = _OUT = None
+_sess_lock = threading.Lock()
+
+def load_session():
+    """Return this process's ONNX Runtime session, creating it on first use."""
+    global _ort_sess, _INP, _OUT
+    with _sess_lock:
+        if _ort_sess is None:
+            sess = _create_session()
+            _INP = sess.get_inputs()[0].name
+            _OUT = sess.get_outputs()[0].name
+            _ort_sess = sess
+    return _ort_sess
 
 # MoveNet index → MediaPipe index (17 body points)
 _MP_ORDER = [
@@ -53,7 +106,8 @@ def infer_pose_bgr(frame_bgr: np.ndarray) -> np.ndarray:
     crop = frame_bgr[y0:y0+size, x0:x0+size]
 
     inp  = cv2.resize(crop, (256, 256))[None].astype(np.uint8)
-    out  = _ort_sess.run([_OUT], {_INP: inp})[0][0]   # 17×3
+    sess = _ort_sess or load_session()
+    out  = sess.run([_OUT], {_INP: inp})[0][0]   # 17×3
 
     # x,y back to absolute pixels
     out[:, 0] = out[:, 0] * size + x0
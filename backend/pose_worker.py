@@ -0,0 +1,235 @@
+import contextlib
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+# POSE_DELEGATE=gpu runs inference on the TFLite GPU delegate (OpenGL ES / Metal) when the
+# host has one; landmarkers fall back to the CPU if the delegate can't be created
+POSE_DELEGATE = os.environ.get('POSE_DELEGATE', 'cpu').upper()
+if POSE_DELEGATE not in ('CPU', 'GPU'):
+    raise ValueError(f"POSE_DELEGATE must be cpu or gpu, not {POSE_DELEGATE.lower()!r}")
+
+
+def create_pose_landmarker(model_path, running_mode='IMAGE'):
+    """Build a PoseLandmarker with the settings shared by every inference path."""
+    import mediapipe as mp
+
+    def build(delegate):
+        return mp.tasks.vision.PoseLandmarker.create_from_options(
+            mp.tasks.vision.PoseLandmarkerOptions(
+                base_options=mp.tasks.BaseOptions(
+                    model_asset_path=model_path,
+                    delegate=getattr(mp.tasks.BaseOptions.Delegate, delegate)
+                ),
+                running_mode=getattr(mp.tasks.vision.RunningMode, running_mode),
+                num_poses=1,  # one lifter per video
+                min_pose_detection_confidence=0.5,
+                min_pose_presence_confidence=0.5,
+                min_tracking_confidence=0.5
+            )
+        )
+
+    if POSE_DELEGATE == 'GPU':
+        try:
+            return build('GPU')
+        except (RuntimeError, ValueError, NotImplementedError) as e:
+            print(f"[Squat] GPU delegate unavailable, falling back to CPU: {e}")
+    return build('CPU')
+
+
+class VideoLandmarker:
+    """A VIDEO-mode landmarker that can be reused for one video after another.
+
+    VIDEO mode tracks the pose from the previous frame instead of re-detecting it,
+    but needs strictly increasing timestamps for the landmarker's whole lifetime,
+    so each new segment (video) is offset past the last timestamp used.
+    """
+    def __init__(self, model_path):
+        self._landmarker = create_pose_landmarker(model_path, 'VIDEO')
+        self._base_ms = 0
+        self._last_ms = -1
+
+    def start_segment(self):
+        self._base_ms = self._last_ms + 1
+
+    def detect(self, mp_image, frame_ms):
+        timestamp_ms = max(self._base_ms + frame_ms, self._last_ms + 1)
+        self._last_ms = timestamp_ms
+        return self._landmarker.detect_for_video(mp_image, timestamp_ms)
+
+    def close(self):
+        self._landmarker.close()
+
+
+class ImageLandmarker:
+    """An IMAGE-mode landmarker with VideoLandmarker's detect() signature.
+
+    Every frame is detected on its own, so frames can be fed in any order; the
+    timestamp is accepted and ignored.
+    """
+    def __init__(self, model_path):
+        self._landmarker = create_pose_landmarker(model_path)
+
+    def detect(self, mp_image, frame_ms):
+        return self._landmarker.detect(mp_image)
+
+    def close(self):
+        self._landmarker.close()
+
+
+class VideoLandmarkerPool:
+    """Check out one VideoLandmarker per concurrently analysed video, creating them on demand.
+
+    Each landmarker is a full model in memory, so at most `max_size` exist; a video
+    that finds them all checked out waits for one to be returned.
+    """
+    def __init__(self, model_path, max_size=2):
+        self.model_path = model_path
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = queue.LifoQueue()
+        self._closed = False
+
+    @contextlib.contextmanager
+    def segment(self):
+        self._slots.acquire()
+        try:
+            try:
+                landmarker = self._idle.get_nowait()
+            except queue.Empty:
+                landmarker = VideoLandmarker(self.model_path)
+            landmarker.start_segment()
+            try:
+                yield landmarker
+            finally:
+                if self._closed:
+                    landmarker.close()
+                else:
+                    self._idle.put(landmarker)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Close the idle landmarkers; ones still checked out are closed when returned."""
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def _inference_loop(model_path, requests_q, results_q):
+    """Child process: own a landmarker and answer detect jobs until told to stop."""
+    import mediapipe as mp
+
+    landmarker = create_pose_landmarker(model_path)
+    while True:
+        job = requests_q.get()
+        if job is None:
+            break
+        job_id, shm_name, shape = job
+        try:
+            shm = shared_memory.SharedMemory(name=shm_name)
+            try:
+                frame_rgb = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+                mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=frame_rgb)
+                detection_result = landmarker.detect(mp_image)
+                # Drop the views on the shared buffer before closing it
+                del frame_rgb, mp_image
+            finally:
+                shm.close()
+            results_q.put((job_id, detection_result.pose_landmarks, None))
+        except Exception as e:
+            results_q.put((job_id, None, f"{type(e).__name__}: {e}"))
+    landmarker.close()
+
+
+class PoseWorker:
+    """Run MediaPipe pose detection in a dedicated process.
+
+    Frames travel through shared memory, so only a tiny job tuple crosses the
+    queue, and the calling Flask thread just waits on a Future while the child
+    does the work outside this interpreter's GIL. The child is started lazily
+    (and restarted after a fork) so gunicorn --preload workers each get their own.
+    """
+    def __init__(self, model_path, timeout=30):
+        self.model_path = model_path
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid() and self._process.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._process.is_alive():
+                return
+            # spawn, not fork: MediaPipe/TFLite state does not survive a fork
+            ctx = multiprocessing.get_context('spawn')
+            self._requests = ctx.Queue()
+            self._results = ctx.Queue()
+            self._pending = {}
+            self._ids = itertools.count()
+            self._process = ctx.Process(
+                target=_inference_loop,
+                args=(self.model_path, self._requests, self._results),
+                name='pose-inference',
+                daemon=True
+            )
+            self._process.start()
+            threading.Thread(target=self._collect, args=(self._process, self._results, self._pending),
+                             name='pose-inference-results', daemon=True).start()
+            self._pid = os.getpid()
+
+    def _collect(self, process, results_q, pending):
+        while True:
+            try:
+                job_id, pose_landmarks, error = results_q.get(timeout=1)
+            except queue.Empty:
+                if process.is_alive():
+                    continue
+                # The child died (crash or OOM kill): fail what's waiting on it rather than
+                # leaving callers to their timeout; the next detect() starts a new child
+                with self._lock:
+                    futures = list(pending.values())
+                    pending.clear()
+                for future in futures:
+                    future.set_exception(RuntimeError(
+                        f"Pose worker exited with code {process.exitcode}"))
+                return
+            with self._lock:
+                future = pending.pop(job_id, None)
+            if future is None:
+                continue
+            if error is not None:
+                future.set_exception(RuntimeError(f"Pose worker failed: {error}"))
+            else:
+                future.set_result(pose_landmarks)
+
+    def detect(self, frame_rgb):
+        """Return the list of detected poses (each a list of 33 landmarks) for an RGB frame."""
+        self._ensure_started()
+        frame_rgb = np.ascontiguousarray(frame_rgb, dtype=np.uint8)
+        shm = shared_memory.SharedMemory(create=True, size=frame_rgb.nbytes)
+        try:
+            np.ndarray(frame_rgb.shape, dtype=np.uint8, buffer=shm.buf)[...] = frame_rgb
+            future = Future()
+            with self._lock:
+                job_id = next(self._ids)
+                self._pending[job_id] = future
+            self._requests.put((job_id, shm.name, frame_rgb.shape))
+            try:
+                return future.result(timeout=self.timeout)
+            finally:
+                with self._lock:
+                    self._pending.pop(job_id, None)
+        finally:
+            shm.close()
+            shm.unlink()
@@ -0,0 +1,518 @@
+"""Batched numeric kernels for the video analysis path.
+
+Each kernel works on a stacked landmark array of shape (N, 33, 4) holding
+[x, y, z, visibility] per MediaPipe landmark, one row per analysed frame.
+Numba compiles them to native loops when it is installed; otherwise the
+equivalent NumPy expressions are used. The loops are deliberately serial: N is at
+most a few thousand frames, and numba's parallel threading layers are neither
+fork-safe (OpenMP) nor safe to enter from several request threads (workqueue).
+"""
+import math
+
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:  # pragma: no cover - numba is optional
+    NUMBA_AVAILABLE = False
+
+# MediaPipe landmark indices used by the kernels (module constants are frozen into the JIT)
+RIGHT_SHOULDER, LEFT_SHOULDER = 12, 11
+RIGHT_HIP, LEFT_HIP = 24, 23
+RIGHT_KNEE, LEFT_KNEE = 26, 25
+RIGHT_ANKLE, LEFT_ANKLE = 28, 27
+
+# Side codes used by the per-frame side selectors
+SIDE_NONE, SIDE_RIGHT, SIDE_LEFT = -1, 0, 1
+
+# Status codes returned by frame_statuses(); index STATUS_LABELS to get the wire strings
+STATUS_GOOD, STATUS_WARN, STATUS_BAD = 0, 1, 2
+STATUS_LABELS = ('good', 'warn', 'bad')
+
+
+def _depth_ratios_np(lm, side):
+    # float64 throughout, like the per-landmark Python floats the ratio was first computed on
+    ys = lm[:, :, 1].astype(np.float64)
+    left = side == SIDE_LEFT
+    hip_y = np.where(left, ys[:, LEFT_HIP], ys[:, RIGHT_HIP])
+    knee_y = np.where(left, ys[:, LEFT_KNEE], ys[:, RIGHT_KNEE])
+    ankle_y = np.where(left, ys[:, LEFT_ANKLE], ys[:, RIGHT_ANKLE])
+    hip_to_ankle = np.abs(hip_y - ankle_y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = np.where(hip_to_ankle < 1e-6, 0.0, knee_y / hip_to_ankle * 100)
+    return np.where(side == SIDE_NONE, np.nan, ratios)
+
+
+def joints_ok(lm, vis_thr, tracked):
+    """Per-frame, per-landmark usability mask of shape (N, 33).
+
+    A landmark is usable when it is visible enough or is one of the `tracked`
+    landmarks (a (33,) bool mask) - i.e. anything but an untracked placeholder row.
+    """
+    return (lm[:, :, 3] >= vis_thr) | tracked
+
+
+def hips_below_knees(lm):
+    """Per-frame bool: either hip is lower in the image than the knee on the same side."""
+    return (lm[:, RIGHT_HIP, 1] > lm[:, RIGHT_KNEE, 1]) | (lm[:, LEFT_HIP, 1] > lm[:, LEFT_KNEE, 1])
+
+
+def _shoulder_midfoot_diffs_np(lm, ok):
+    right_ok = ok[:, [RIGHT_SHOULDER, RIGHT_HIP, RIGHT_KNEE, RIGHT_ANKLE]].all(axis=1)
+    left_ok = ok[:, [LEFT_SHOULDER, LEFT_HIP, LEFT_KNEE, LEFT_ANKLE]].all(axis=1)
+    xs = lm[:, :, 0].astype(np.float64)
+    right = np.where(right_ok, (xs[:, RIGHT_SHOULDER] - xs[:, RIGHT_ANKLE]) * 100, np.nan)
+    left = np.where(left_ok, (xs[:, LEFT_SHOULDER] - xs[:, LEFT_ANKLE]) * 100, np.nan)
+    # Worst forward lean wins; a side that isn't visible never does
+    take_left = np.isnan(right) | (np.abs(left) > np.abs(right))
+    return np.where(take_left, left, right)
+
+
+def joint_angles(lm, a, b, c, ok):
+    """Angle (degrees) at joint b of a-b-c per frame, in the image plane.
+
+    Matches calculate_angle(): 0 for a degenerate (zero-length) limb, NaN where
+    any of the three joints isn't usable according to the joints_ok() mask.
+    """
+    pts = lm[:, [a, b, c], :2].astype(np.float64)
+    ba = pts[:, 0] - pts[:, 1]
+    bc = pts[:, 2] - pts[:, 1]
+    norm_ba = np.hypot(ba[:, 0], ba[:, 1])
+    norm_bc = np.hypot(bc[:, 0], bc[:, 1])
+    degenerate = (norm_ba < 1e-6) | (norm_bc < 1e-6)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cosine = (ba * bc).sum(axis=1) / (norm_ba * norm_bc)
+    angles = np.where(degenerate, 0.0, np.degrees(np.arccos(np.clip(cosine, -1.0, 1.0))))
+    return np.where(ok[:, [a, b, c]].all(axis=1), angles, np.nan)
+
+
+def _knee_angles_np(lm, ok):
+    right = joint_angles(lm, RIGHT_HIP, RIGHT_KNEE, RIGHT_ANKLE, ok)
+    left = joint_angles(lm, LEFT_HIP, LEFT_KNEE, LEFT_ANKLE, ok)
+    take_left = np.isnan(right) | (left < right)
+    angles = np.where(take_left, left, right)
+    sides = np.where(take_left, SIDE_LEFT, SIDE_RIGHT).astype(np.int8)
+    sides[np.isnan(angles)] = SIDE_NONE
+    return angles, sides
+
+
+def _hip_flexion_angles_np(lm, ok):
+    right = joint_angles(lm, RIGHT_SHOULDER, RIGHT_HIP, RIGHT_KNEE, ok)
+    left = joint_angles(lm, LEFT_SHOULDER, LEFT_HIP, LEFT_KNEE, ok)
+    both = np.stack([right, left])
+    counts = (~np.isnan(both)).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(counts > 0, np.nansum(both, axis=0) / counts, np.nan)
+
+
+def pelvic_angles(lm):
+    """Trunk angle from vertical (degrees) between the shoulder and hip centres per frame; positive leans forward."""
+    pts = lm[:, :, :2].astype(np.float64)
+    shoulder_c = (pts[:, LEFT_SHOULDER] + pts[:, RIGHT_SHOULDER]) / 2.0
+    hip_c = (pts[:, LEFT_HIP] + pts[:, RIGHT_HIP]) / 2.0
+    dx = hip_c[:, 0] - shoulder_c[:, 0]
+    dy = hip_c[:, 1] - shoulder_c[:, 1]  # positive downwards in image coords
+    return np.where(dy == 0, 0.0, np.degrees(np.arctan2(dx, dy)))
+
+
+def _carry_forward(values, initial):
+    """Replace each NaN with the last non-NaN value before it (`initial` before the first)."""
+    filled = np.concatenate(([initial], values))
+    last_set = np.where(np.isnan(filled), 0, np.arange(filled.size))
+    return filled[np.maximum.accumulate(last_set)][1:]
+
+
+def _round1(x):
+    """np.round(x, 1) that also agrees with Python's round(x, 1) where x * 10 lands on a .5 tie."""
+    scaled = x * 10
+    out = np.rint(scaled) / 10
+    # Only an exact tie after scaling can round differently from the exact decimal value
+    ties = np.flatnonzero(np.abs(scaled - np.trunc(scaled)) == 0.5)
+    if ties.size:
+        out[ties] = [round(value, 1) for value in x[ties].tolist()]
+    return out
+
+
+def depth_scores(best_knee, hip_below):
+    """Depth score per frame: full marks at or below 70 degrees (or hip below knee), none from 90, linear between."""
+    return np.where(hip_below | (best_knee <= 70), 100.0,
+                    np.where(best_knee >= 90, 0.0, (90 - best_knee) / 20.0 * 100.0))
+
+
+def shoulder_scores(worst_diff):
+    """Shoulder alignment score per frame: full marks up to an offset of 2, none from 10, linear between."""
+    return np.where(worst_diff <= 2, 100.0,
+                    np.where(worst_diff >= 10, 0.0, (10 - worst_diff) / 8 * 100.0))
+
+
+def hip_flexion_scores(angle):
+    """Vectorised calc_hip_flexion_score(); 0 where the angle is NaN."""
+    return np.select(
+        [(angle >= 90) & (angle <= 120), (angle >= 70) & (angle < 90), (angle > 120) & (angle <= 130)],
+        [100.0, (angle - 70) / 20.0 * 100.0, (130 - angle) / 10.0 * 100.0],
+        0.0
+    )
+
+
+def pelvic_tilt_scores(delta_angle):
+    """Vectorised calc_pelvic_tilt_score() for non-negative tilt magnitudes."""
+    return np.where(delta_angle <= 5, 100.0,
+                    np.where(delta_angle >= 15, 0.0, (15 - delta_angle) / 10.0 * 100.0))
+
+
+def _status_codes_np(values, good, warn, higher_is_better):
+    if higher_is_better:
+        conditions = [values >= good, values >= warn, values < warn]
+    else:
+        conditions = [values <= good, values <= warn, values > warn]
+    # NaN matches no condition and is treated as warn
+    return np.select(conditions, [STATUS_GOOD, STATUS_WARN, STATUS_BAD], STATUS_WARN).astype(np.int8)
+
+
+def _frame_statuses_np(lm, depth, visible, spine_good, spine_warn, depth_good, depth_warn):
+    right = joint_angles(lm, RIGHT_SHOULDER, RIGHT_HIP, RIGHT_KNEE, visible)
+    left = joint_angles(lm, LEFT_SHOULDER, LEFT_HIP, LEFT_KNEE, visible)
+    back_angle = np.where(np.isnan(right), left, right)
+    depth_ratio = np.where(depth > 1.5, depth / 100, depth)
+    return (_status_codes_np(back_angle, spine_good, spine_warn, False),
+            _status_codes_np(depth_ratio, depth_good, depth_warn, True))
+
+
+def _score_phase_np(knee, shoulder, hip_flexion, pelvic, hip_below, carry):
+    has_knee = ~np.isnan(knee)
+    # Shoulder, hip and pelvic scores only move once the knees are bent or the hips are low
+    with np.errstate(invalid='ignore'):
+        active = hip_below | (knee < 150)
+
+    best_knee = np.fmin.accumulate(np.concatenate(([180.0], knee)))[1:]
+    knee_depth = _carry_forward(
+        np.where(has_knee, _round1(depth_scores(best_knee, hip_below)), np.nan), carry[0])
+
+    use_shoulder = active & ~np.isnan(shoulder)
+    worst_shoulder = np.maximum.accumulate(np.where(use_shoulder, np.abs(shoulder), 0.0))
+    shoulder_align = np.minimum.accumulate(np.concatenate(
+        ([carry[1]], np.where(use_shoulder, _round1(shoulder_scores(worst_shoulder)), np.inf))))[1:]
+
+    use_hip = active & ~np.isnan(hip_flexion)
+    best_hip = np.maximum.accumulate(np.where(use_hip, hip_flexion_scores(hip_flexion), 0.0))
+    hip_score = _carry_forward(np.where(use_hip, _round1(best_hip), np.nan), carry[2])
+
+    use_pelvic = active & ~np.isnan(pelvic)
+    best_pelvic = np.minimum.accumulate(np.where(use_pelvic, pelvic_tilt_scores(np.abs(pelvic)), 100.0))
+    pelvic_tilt = _carry_forward(np.where(use_pelvic, _round1(best_pelvic), np.nan), carry[3])
+
+    total_weight = 0.4 + 0.3 + 0.2 + 0.1
+    overall = _round1(
+        (knee_depth * 0.4 + shoulder_align * 0.3 + hip_score * 0.2 + pelvic_tilt * 0.1) / total_weight)
+    return np.column_stack((knee_depth, shoulder_align, hip_score, pelvic_tilt, overall))
+
+
+if NUMBA_AVAILABLE:
+    # No fastmath: NaN marks the frames without a knee side
+    @njit(cache=True)
+    def _depth_ratios_nb(lm, side):
+        out = np.empty(lm.shape[0], dtype=np.float64)
+        for i in range(lm.shape[0]):
+            if side[i] == SIDE_NONE:
+                out[i] = np.nan
+                continue
+            if side[i] == SIDE_LEFT:
+                hip_y, knee_y, ankle_y = np.float64(lm[i, LEFT_HIP, 1]), np.float64(lm[i, LEFT_KNEE, 1]), np.float64(lm[i, LEFT_ANKLE, 1])
+            else:
+                hip_y, knee_y, ankle_y = np.float64(lm[i, RIGHT_HIP, 1]), np.float64(lm[i, RIGHT_KNEE, 1]), np.float64(lm[i, RIGHT_ANKLE, 1])
+            hip_to_ankle = abs(hip_y - ankle_y)
+            out[i] = 0.0 if hip_to_ankle < 1e-6 else knee_y / hip_to_ankle * 100
+        return out
+
+    @njit(cache=True)
+    def _angle_at(lm, i, a, b, c, ok):
+        # Scalar joint_angles() for frame i
+        if not (ok[i, a] and ok[i, b] and ok[i, c]):
+            return np.nan
+        ba_x = np.float64(lm[i, a, 0]) - np.float64(lm[i, b, 0])
+        ba_y = np.float64(lm[i, a, 1]) - np.float64(lm[i, b, 1])
+        bc_x = np.float64(lm[i, c, 0]) - np.float64(lm[i, b, 0])
+        bc_y = np.float64(lm[i, c, 1]) - np.float64(lm[i, b, 1])
+        norm_ba = math.hypot(ba_x, ba_y)
+        norm_bc = math.hypot(bc_x, bc_y)
+        if norm_ba < 1e-6 or norm_bc < 1e-6:
+            return 0.0
+        cosine = (ba_x * bc_x + ba_y * bc_y) / (norm_ba * norm_bc)
+        return math.degrees(math.acos(min(1.0, max(-1.0, cosine))))
+
+    # No fastmath on the angle kernels either: NaN marks a side whose joints aren't usable
+    @njit(cache=True)
+    def _knee_angles_nb(lm, ok):
+        angles = np.empty(lm.shape[0], dtype=np.float64)
+        sides = np.empty(lm.shape[0], dtype=np.int8)
+        for i in range(lm.shape[0]):
+            right = _angle_at(lm, i, RIGHT_HIP, RIGHT_KNEE, RIGHT_ANKLE, ok)
+            left = _angle_at(lm, i, LEFT_HIP, LEFT_KNEE, LEFT_ANKLE, ok)
+            if np.isnan(right) or left < right:
+                angles[i] = left
+                sides[i] = SIDE_NONE if np.isnan(left) else SIDE_LEFT
+            else:
+                angles[i] = right
+                sides[i] = SIDE_RIGHT
+        return angles, sides
+
+    @njit(cache=True)
+    def _hip_flexion_angles_nb(lm, ok):
+        out = np.empty(lm.shape[0], dtype=np.float64)
+        for i in range(lm.shape[0]):
+            right = _angle_at(lm, i, RIGHT_SHOULDER, RIGHT_HIP, RIGHT_KNEE, ok)
+            left = _angle_at(lm, i, LEFT_SHOULDER, LEFT_HIP, LEFT_KNEE, ok)
+            if np.isnan(right):
+                out[i] = left
+            elif np.isnan(left):
+                out[i] = right
+            else:
+                out[i] = (right + left) / 2
+        return out
+
+    @njit(cache=True)
+    def _round1_nb(x):
+        # round(x, 1) as Python does it: when x * 10 lands on a .5 tie, the exact
+        # product (Dekker's two-product error term) decides the direction
+        scaled = x * 10.0
+        rounded = np.rint(scaled)
+        if abs(scaled - math.trunc(scaled)) == 0.5:
+            split = 134217729.0 * x
+            high = split - (split - x)
+            err = (high * 10.0 - scaled) + (x - high) * 10.0
+            if err > 0:
+                rounded = math.floor(scaled) + 1.0
+            elif err < 0:
+                rounded = math.floor(scaled)
+        return rounded / 10.0
+
+    @njit(cache=True)
+    def _score_phase_nb(knee, shoulder, hip_flexion, pelvic, hip_below, carry):
+        out = np.empty((knee.shape[0], 5), dtype=np.float64)
+        knee_depth, shoulder_align, hip_score, pelvic_tilt = carry[0], carry[1], carry[2], carry[3]
+        best_knee, worst_shoulder, best_hip, best_pelvic = 180.0, 0.0, 0.0, 100.0
+        total_weight = 0.4 + 0.3 + 0.2 + 0.1
+        for i in range(knee.shape[0]):
+            angle = knee[i]
+            active = hip_below[i] or angle < 150
+            if not np.isnan(angle):
+                best_knee = min(best_knee, angle)
+                if hip_below[i] or best_knee <= 70:
+                    depth = 100.0
+                elif best_knee >= 90:
+                    depth = 0.0
+                else:
+                    depth = (90 - best_knee) / 20.0 * 100.0
+                knee_depth = _round1_nb(depth)
+            if active and not np.isnan(shoulder[i]):
+                worst_shoulder = max(worst_shoulder, abs(shoulder[i]))
+                if worst_shoulder <= 2:
+                    align = 100.0
+                elif worst_shoulder >= 10:
+                    align = 0.0
+                else:
+                    align = (10 - worst_shoulder) / 8 * 100.0
+                shoulder_align = min(shoulder_align, _round1_nb(align))
+            hip_angle = hip_flexion[i]
+            if active and not np.isnan(hip_angle):
+                if 90 <= hip_angle <= 120:
+                    hip = 100.0
+                elif 70 <= hip_angle < 90:
+                    hip = (hip_angle - 70) / 20.0 * 100.0
+                elif 120 < hip_angle <= 130:
+                    hip = (130 - hip_angle) / 10.0 * 100.0
+                else:
+                    hip = 0.0
+                best_hip = max(best_hip, hip)
+                hip_score = _round1_nb(best_hip)
+            if active and not np.isnan(pelvic[i]):
+                tilt = abs(pelvic[i])
+                if tilt <= 5:
+                    tilt_score = 100.0
+                elif tilt >= 15:
+                    tilt_score = 0.0
+                else:
+                    tilt_score = (15 - tilt) / 10.0 * 100.0
+                best_pelvic = min(best_pelvic, tilt_score)
+                pelvic_tilt = _round1_nb(best_pelvic)
+            out[i, 0] = knee_depth
+            out[i, 1] = shoulder_align
+            out[i, 2] = hip_score
+            out[i, 3] = pelvic_tilt
+            out[i, 4] = _round1_nb(
+                (knee_depth * 0.4 + shoulder_align * 0.3 + hip_score * 0.2 + pelvic_tilt * 0.1) / total_weight)
+        return out
+
+    @njit(cache=True)
+    def _frame_statuses_nb(lm, depth, visible, spine_good, spine_warn, depth_good, depth_warn):
+        spine = np.empty(lm.shape[0], dtype=np.int8)
+        knee = np.empty(lm.shape[0], dtype=np.int8)
+        for i in range(lm.shape[0]):
+            back_angle = _angle_at(lm, i, RIGHT_SHOULDER, RIGHT_HIP, RIGHT_KNEE, visible)
+            if np.isnan(back_angle):
+                back_angle = _angle_at(lm, i, LEFT_SHOULDER, LEFT_HIP, LEFT_KNEE, visible)
+            # Comparisons with NaN are false, so unknown values end up as warn
+            if back_angle <= spine_good:
+                spine[i] = STATUS_GOOD
+            elif back_angle > spine_warn:
+                spine[i] = STATUS_BAD
+            else:
+                spine[i] = STATUS_WARN
+            depth_ratio = depth[i] / 100 if depth[i] > 1.5 else depth[i]
+            if depth_ratio >= depth_good:
+                knee[i] = STATUS_GOOD
+            elif depth_ratio < depth_warn:
+                knee[i] = STATUS_BAD
+            else:
+                knee[i] = STATUS_WARN
+        return spine, knee
+
+    # fastmath is left off here: the kernel relies on NaN to mark "no visible side"
+    @njit(cache=True)
+    def _shoulder_midfoot_diffs_nb(lm, ok):
+        out = np.empty(lm.shape[0], dtype=np.float64)
+        for i in range(lm.shape[0]):
+            best = np.nan
+            if ok[i, RIGHT_SHOULDER] and ok[i, RIGHT_HIP] and ok[i, RIGHT_KNEE] and ok[i, RIGHT_ANKLE]:
+                best = (np.float64(lm[i, RIGHT_SHOULDER, 0]) - np.float64(lm[i, RIGHT_ANKLE, 0])) * 100
+            if ok[i, LEFT_SHOULDER] and ok[i, LEFT_HIP] and ok[i, LEFT_KNEE] and ok[i, LEFT_ANKLE]:
+                left = (np.float64(lm[i, LEFT_SHOULDER, 0]) - np.float64(lm[i, LEFT_ANKLE, 0])) * 100
+                if np.isnan(best) or abs(left) > abs(best):
+                    best = left
+            out[i] = best
+        return out
+
+
+def knee_angles(lm, ok):
+    """Deeper (smaller) visible knee angle per frame and the side it came from.
+
+    Returns (angles, sides): angles are NaN and sides SIDE_NONE where neither leg
+    is visible; the right leg wins ties.
+    """
+    if NUMBA_AVAILABLE:
+        return _knee_angles_nb(lm, ok)
+    return _knee_angles_np(lm, ok)
+
+
+def hip_flexion_angles(lm, ok):
+    """Mean shoulder-hip-knee angle over the visible sides per frame; NaN when neither is visible."""
+    if NUMBA_AVAILABLE:
+        return _hip_flexion_angles_nb(lm, ok)
+    return _hip_flexion_angles_np(lm, ok)
+
+
+def depth_ratios(lm, side):
+    """Depth ratio (x100) per frame using the hip/knee/ankle of the chosen side; NaN where side is SIDE_NONE."""
+    if NUMBA_AVAILABLE:
+        return _depth_ratios_nb(lm, side)
+    return _depth_ratios_np(lm, side)
+
+
+def shoulder_midfoot_diffs(lm, ok):
+    """Signed shoulder-to-midfoot offset (x100) per frame, worst visible side; NaN when neither side is visible."""
+    if NUMBA_AVAILABLE:
+        return _shoulder_midfoot_diffs_nb(lm, ok)
+    return _shoulder_midfoot_diffs_np(lm, ok)
+
+
+def frame_statuses(lm, depth, spine_thresholds, depth_thresholds):
+    """Per-frame spine and knee status codes (STATUS_GOOD / _WARN / _BAD) as two int8 arrays.
+
+    The spine status grades the shoulder-hip-knee angle, right side preferred, each
+    side only when all three joints have visibility >= 0.5; `spine_thresholds` is
+    the (good, warn) pair of maximum angles. The knee status grades the depth ratio
+    column (x100 values are scaled back), with `depth_thresholds` the (good, warn)
+    pair of minimum ratios. Unknown values are graded warn.
+    """
+    visible = lm[:, :, 3] >= 0.5
+    depth = np.asarray(depth, dtype=np.float64)
+    # Always floats, so the kernel compiled by warm_up() is the one that gets reused
+    thresholds = tuple(map(float, (*spine_thresholds, *depth_thresholds)))
+    if NUMBA_AVAILABLE:
+        return _frame_statuses_nb(lm, depth, visible, *thresholds)
+    return _frame_statuses_np(lm, depth, visible, *thresholds)
+
+
+def score_phase(knee, shoulder, hip_flexion, pelvic, hip_below, carry):
+    """Progressive per-frame scores over the frames of one squat phase.
+
+    Inputs are per-frame measurement arrays (NaN where missing) plus the bool
+    hip-below-knee column; `carry` holds the (knee_depth, shoulder_align,
+    hip_flexion, pelvic_tilt) scores of the frame before the phase. Within the
+    phase depth follows the deepest knee angle so far, shoulder alignment the
+    worst offset (and never recovers), and hip/pelvic the best score so far; a
+    frame without a usable measurement keeps the previous frame's score.
+
+    Returns an (N, 5) array of rounded knee_depth, shoulder_align, hip_flexion,
+    pelvic_tilt and overall scores.
+    """
+    if NUMBA_AVAILABLE:
+        return _score_phase_nb(knee, shoulder, hip_flexion, pelvic, hip_below,
+                               np.asarray(carry, dtype=np.float64))
+    return _score_phase_np(knee, shoulder, hip_flexion, pelvic, hip_below, carry)
+
+
+def warm_up():
+    """Compile (or load from the numba cache) every kernel so the first request doesn't pay for it."""
+    if not NUMBA_AVAILABLE:
+        return
+    lm = np.zeros((1, 33, 4), dtype=np.float32)
+    ok = np.ones((1, 33), dtype=bool)
+    _, sides = knee_angles(lm, ok)
+    depth_ratios(lm, sides)
+    shoulder_midfoot_diffs(lm, ok)
+    hip_flexion_angles(lm, ok)
+    column = np.zeros(1, dtype=np.float64)
+    frame_statuses(lm, column, (45.0, 55.0), (0.85, 0.6))
+    score_phase(column, column, column, column, np.zeros(1, dtype=bool), (0.0, 100.0, 0.0, 100.0))
+
+
+def check_equivalence(n=20000, seed=0):
+    """Assert that the numba kernels and their NumPy fallbacks return identical arrays.
+
+    Runs both on `n` random frames (some with untracked, degenerate or NaN-producing
+    rows) and compares bit for bit, NaNs included. Joint angles are the exception:
+    numba's acos/degrees may round the last bit differently from NumPy's, so they
+    are compared to 1e-12 relative. Run with `python squat_kernels.py`.
+    """
+    if not NUMBA_AVAILABLE:
+        raise RuntimeError("numba is not installed; only the NumPy kernels are in use")
+    rng = np.random.default_rng(seed)
+    lm = rng.random((n, 33, 4), dtype=np.float32)
+    lm[rng.random(n) < 0.05] = 0.0  # all-zero rows: degenerate limbs
+    flat = rng.random(n) < 0.05  # hip level with ankle: the zero-length leg branch
+    lm[flat, RIGHT_ANKLE, 1] = lm[flat, RIGHT_HIP, 1]
+    lm[flat, LEFT_ANKLE, 1] = lm[flat, LEFT_HIP, 1]
+    ok = joints_ok(lm, 0.3, np.zeros(33, dtype=bool))
+
+    angles_nb, sides_nb = _knee_angles_nb(lm, ok)
+    angles_np, sides_np = _knee_angles_np(lm, ok)
+    np.testing.assert_allclose(angles_nb, angles_np, rtol=1e-12)
+    np.testing.assert_array_equal(sides_nb, sides_np)
+    np.testing.assert_allclose(_hip_flexion_angles_nb(lm, ok), _hip_flexion_angles_np(lm, ok), rtol=1e-12)
+    np.testing.assert_array_equal(_depth_ratios_nb(lm, sides_np), _depth_ratios_np(lm, sides_np))
+    np.testing.assert_array_equal(_shoulder_midfoot_diffs_nb(lm, ok), _shoulder_midfoot_diffs_np(lm, ok))
+
+    depth = rng.random(n) * 150
+    depth[rng.random(n) < 0.1] = np.nan
+    visible = lm[:, :, 3] >= 0.5
+    thresholds = (45.0, 55.0, 0.85, 0.6)
+    for nb, ref in zip(_frame_statuses_nb(lm, depth, visible, *thresholds),
+                       _frame_statuses_np(lm, depth, visible, *thresholds)):
+        np.testing.assert_array_equal(nb, ref)
+
+    knee = np.where(rng.random(n) < 0.1, np.nan, rng.random(n) * 180)
+    shoulder = np.where(rng.random(n) < 0.1, np.nan, rng.normal(0, 8, n))
+    hip = np.where(rng.random(n) < 0.1, np.nan, rng.random(n) * 180)
+    pelvic = np.where(rng.random(n) < 0.1, np.nan, rng.normal(0, 10, n))
+    hip_below = rng.random(n) < 0.2
+    carry = (0.0, 100.0, 0.0, 100.0)
+    np.testing.assert_array_equal(
+        _score_phase_nb(knee, shoulder, hip, pelvic, hip_below, np.asarray(carry)),
+        _score_phase_np(knee, shoulder, hip, pelvic, hip_below, carry))
+
+
+if __name__ == '__main__':
+    check_equivalence()
+    print("numba and NumPy kernels agree")